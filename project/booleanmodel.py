@@ -14,19 +14,32 @@ The aim of this project is to implement an Information Retrieval system using th
 
 from functools import total_ordering, reduce   # helper functions
 import csv                                     # for csv files
+import gzip                                    # for the compressed files of the corpus
 import re                                      # for regular expressions
 import pickle                                  # to save the index
 import time
 import os.path
 import copy
+import mmap                                    # to map the index file in memory
+import struct                                  # for the header of the index file
+import zlib                                    # for the keys of the deletion index
+from array import array                        # compact arrays of integers
+from bisect import bisect_left, bisect_right   # binary search on sorted arrays
 from typing import List                        # for type hint checking
+from collections import OrderedDict, Counter   # for the LRU cache and the biword index
+from itertools import groupby, accumulate, repeat
+import heapq                                   # for the multiway merge
+import tempfile                                # for the blocks of the index construction
+import shutil                                  # to decompress the corpus
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor  # to build the index in parallel
 
 """## Postings
 
 A **<font color=#00ADEF>posting</font>** is an element of the posting list, so it is a DocID associated to
 a specific term. To answer phrase queries we add, for each posting, also the set of positions in which the term appear in the document.
 
-So a `Posting` object contains the docID of a document, stored in the variable `_docID`, and the list of the positions in which the term appear in the document. It has a method `get_from_corpus` that given the corpus retrieves the document corresponding to that docID. It has a method `add` to extend the list of positions. Then it has some comparison methods to check if two docID are equal, one greater than the other, etc.
+So a `Posting` object contains the docID of a document, stored in the variable `_docID`, and the list of the positions in which the term appear in the document. A `PostingList` does not store `Posting` objects (it would take too much memory), but it returns them when it is indexed. It has a method `get_from_corpus` that given the corpus retrieves the document corresponding to that docID. It has a method `add` to extend the list of positions. Then it has some comparison methods to check if two docID are equal, one greater than the other, etc.
 """
 
 @total_ordering   # takes a class where we have defined at least the methods `eq` and `gt`/`lt` and defines in a consistent way all the other methods (otherwise we should implement them all by hand)
@@ -80,36 +93,178 @@ class Posting:
 
 A **<font color=#00ADEF>posting list</font>** is list of DocIDs associated to a term, so given a term it is the set of doc that contain that term.
 
-So a `PostingList` object is a list of `Posting`s. You can construct an empty `PostingList` with `__init__`, or construct and initialize a `PostingList` directly with one docID with `from_docID`, or you can create a `PostingList` object with an already existing list using `from_posting_list`. Then you can merge two posting list with `merge` (the one in input will be added at the end of the one on which the mehod `merge` is called, without any checking on the total ordering of the list), you can intersect them with `intersection` or you can unify them with `union`. With `get_from_corpus` we can retrieve the documents corresponding to the docID stored in this `PostingList`.
+Storing a posting list as a Python list of `Posting` objects costs a full object (with its own list of positions) for every document, so a `PostingList` is stored in a compact way with typed arrays (see [array](https://docs.python.org/3/library/array.html)): `_docIDs` contains the sorted docIDs, `_positions` contains the positions of all the postings one after the other and `_offsets` tells where the positions of each posting start, so the positions of the i-th posting are `_positions[_offsets[i]:_offsets[i+1]]`. When we don't need the positions (e.g. in the plist of all the DocID) `_positions` and `_offsets` are `None`. Indexing a `PostingList` returns a `Posting` object built on the fly.
+
+You can construct an empty `PostingList` with `__init__`, or construct and initialize a `PostingList` directly with one docID with `from_docID`, or you can create a `PostingList` object with an already existing list of `Posting`s using `from_posting_list` or with already existing arrays using `from_arrays`. With `add` you can add a position of a term to the posting list while reading the corpus. Then you can merge two posting list with `merge` (the one in input will be added at the end of the one on which the mehod `merge` is called, without any checking on the total ordering of the list), you can intersect them with `intersection` or you can unify them with `union`. These two operations don't compare the postings one by one in Python, but they use the set operations of Python, which work in C on all the docIDs at once; when a list has no positions (see `without_positions`, used by the boolean queries that only need the docIDs) the whole operation is done like this. When one of the two lists is much shorter than the other one (like when we intersect "yoda" and "a") the intersection uses instead a galloping search (see `gallop`) on the longest list, so it costs as the shortest list. With `get_from_corpus` we can retrieve the documents corresponding to the docID stored in this `PostingList`.
+
+The posting lists can be compressed (see `encode`): the docIDs and the positions are replaced by the gaps between consecutive values, which are small numbers, and each gap is written with variable byte encoding (see `vbyte_encode`) in as few bytes as possible. The index file stores the posting lists compressed, and `compress` keeps a posting list compressed in memory: a compressed posting list is decoded in a single pass the first time that it is used, so only the posting lists used by the queries take the space of the arrays.
 """
 
+def gallop(docs: array, target: int, lo: int = 0) -> int:
+    """ Exponential (or galloping) search: returns the index of the first element of the sorted
+    array `docs`, starting from index `lo`, that is greater or equal than `target`. It looks at
+    lo, lo+1, lo+3, lo+7, ... until it jumps over `target`, then it performs a binary search in
+    the last jump, so it costs O(log d) where d is the distance from `lo` of the result.
+    """
+    hi = lo
+    step = 1
+    while hi < len(docs) and docs[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(docs, target, lo, min(hi, len(docs)))
+
+def vbyte_encode(numbers) -> bytes:
+    """ Variable byte encoding of non-negative integers: each number is written in base 128, from the most
+    significant digit, one digit per byte; the highest bit is set only in the last byte of each number.
+    Small numbers, like the gaps between the docIDs of a frequent term, take a single byte.
+    """
+    data = bytearray()
+    for n in numbers:
+        if n < 0:
+            raise ValueError("Variable byte encoding needs non-negative numbers.")
+        digits = [n & 127 | 128]
+        n >>= 7
+        while n:
+            digits.append(n & 127)
+            n >>= 7
+        data.extend(reversed(digits))
+    return bytes(data)
+
+def vbyte_decode(data) -> list:
+    """ Decodes a sequence of bytes written by `vbyte_encode`.
+    """
+    numbers = []
+    n = 0
+    for byte in data:
+        if byte < 128:
+            n = n << 7 | byte
+        else:
+            numbers.append(n << 7 | byte & 127)
+            n = 0
+    return numbers
+
 class PostingList:
 
-    _postings: List[Posting]
+    _docIDs: array
+    _galloping_ratio = 64   # when a list is this many times longer than the other one, the intersection uses galloping search
+    _bitmap_density = 32    # a list without positions is a bitmap when it contains at least one document every this many docIDs
+    _bitmap_min_length = 64
+    _positions: array
+    _offsets: array
     
     def __init__(self):
         """ Class constructor.
+        Fields:
+          _docIDs    -- array with the sorted docIDs of the postings
+          _positions -- array with the positions of all the postings, one posting after the other (None if we don't store the positions)
+          _offsets   -- array with the index in `_positions` where the positions of each posting start, plus the total length (None if we don't store the positions)
         """
-        self._postings = []    # list of Postings
+        self._docIDs = array('i')
+        self._positions = None
+        self._offsets = None
         
     @classmethod     # to define another constructor. It will return another PostingList like a constructor
     def from_docID(cls, docID, pos = None) -> 'PostingList':
         """ A posting list can be constructed starting from a single docID.
         """
         plist = cls()
+        plist._docIDs.append(docID)
         if pos != None:
-            plist._postings = [Posting(docID, pos)]
-        else:
-            plist._postings = [Posting(docID)]
+            plist._positions = array('i', [pos])
+            plist._offsets = array('i', [0, 1])
         return plist
     
     @classmethod
     def from_posting_list(cls, postingList: list) -> 'PostingList':
-        """ A posting list can also be constructed by using another posting list.
+        """ A posting list can also be constructed by using a list of `Posting`s.
+        """
+        plist = cls()
+        plist._docIDs = array('i', [p._docID for p in postingList])
+        if postingList and postingList[0]._positions is not None:
+            plist._positions = array('i')
+            plist._offsets = array('i', [0])
+            for p in postingList:
+                plist._positions.extend(p._positions)
+                plist._offsets.append(len(plist._positions))
+        return plist
+
+    @classmethod
+    def from_arrays(cls, docIDs: array, positions: array = None, offsets: array = None) -> 'PostingList':
+        """ A posting list can also be constructed directly from its arrays (they are not copied).
         """
         plist = cls()
-        plist._postings = postingList   # we use it as the postings of this PostingList
+        plist._docIDs = docIDs
+        plist._positions = positions
+        plist._offsets = offsets
+        return plist
+
+    @classmethod
+    def from_buffer(cls, buffer, offset: int, n_bytes: int, n_docs: int, n_positions: int) -> 'PostingList':
+        """ A posting list can also be read from a buffer, like a memory-mapped index file, where it has been
+        written by `encode`. It is decoded only when it is used for the first time (see `__getattr__`).
+        """
+        plist = cls.__new__(cls)  # without calling __init__, so the arrays are missing
+        plist._encoded = (buffer, offset, n_bytes, n_docs, n_positions)
         return plist
+
+    def encode(self) -> bytes:
+        """ Compressed representation of the posting list: the gaps between the docIDs followed, if the posting
+        list has the positions, by the number of positions of each posting and by the gaps between the positions
+        of each posting (the first one is the position itself), all with variable byte encoding.
+        """
+        docs = self._docIDs
+        numbers = [b - a for a, b in zip(docs, docs[1:])]
+        if docs:
+            numbers.insert(0, docs[0])
+        if self._positions is not None:
+            offsets = self._offsets
+            positions = self._positions
+            numbers.extend(b - a for a, b in zip(offsets, offsets[1:]))
+            for start, end in zip(offsets, offsets[1:]):
+                if start < end:
+                    numbers.append(positions[start])
+                    numbers.extend(positions[i] - positions[i-1] for i in range(start+1, end))
+        return vbyte_encode(numbers)
+
+    def compress(self):
+        """ Keeps the posting list in memory in its compressed representation (see `encode`): it will be decoded
+        again only when it is used.
+        """
+        if '_encoded' not in self.__dict__:
+            n_positions = -1 if self._positions is None else len(self._positions)
+            data = self.encode()
+            self._encoded = (data, 0, len(data), len(self._docIDs), n_positions)
+            del self._docIDs, self._positions, self._offsets
+
+    def __getattr__(self, name):
+        """ Called only when an attribute is missing, i.e. when the posting list is compressed (it has been read
+        with `from_buffer` or compressed with `compress`): we decode it now.
+        """
+        if name not in ['_docIDs', '_positions', '_offsets'] or '_encoded' not in self.__dict__:
+            raise AttributeError(name)
+        buffer, offset, n_bytes, n_docs, n_positions = self.__dict__.pop('_encoded')
+        numbers = vbyte_decode(buffer[offset : offset + n_bytes])
+        self._docIDs = array('i', accumulate(numbers[:n_docs]))
+        self._positions = self._offsets = None
+        if n_positions >= 0:
+            self._offsets = array('i', accumulate(numbers[n_docs : 2*n_docs], initial=0))
+            self._positions = array('i')
+            gaps = numbers[2*n_docs:]
+            for start, end in zip(self._offsets, self._offsets[1:]):
+                self._positions.extend(accumulate(gaps[start:end]))
+        return getattr(self, name)
+
+    def add(self, docID: int, pos: int):
+        """ Adds the position `pos` of the term in the document `docID`. The docID has to be
+        greater or equal than the last one of the posting list.
+        """
+        if self._docIDs and self._docIDs[-1] == docID:
+            self._offsets[-1] += 1
+        else:
+            self._docIDs.append(docID)
+            self._offsets.append(self._offsets[-1] + 1)
+        self._positions.append(pos)
     
     def merge(self, other: 'PostingList'):
         """ Merges the other posting list to this one in a desctructive
@@ -119,94 +274,360 @@ class PostingList:
         and non-empty. Under those assumptions duplicate docIDs are
         discarded.
         """
+        self.__dict__.pop('_bitmap_list', None)  # the bitmap of the docIDs (see `without_positions`) changes
         i = 0
-        last = self._postings[-1]   # the last element of the current posting list
-        while (i < len(other._postings) and last == other._postings[i]):  # we can have the same docID multiple times (the term is present multiple times in the document) and when we merge them we don't want it multiple times
-            if last._positions:
-                last._positions.extend(other._postings[i]._positions)
+        last = self._docIDs[-1]   # the last docID of the current posting list
+        while (i < len(other._docIDs) and last == other._docIDs[i]):  # we can have the same docID multiple times (the term is present multiple times in the document) and when we merge them we don't want it multiple times
             i += 1
-        self._postings += other._postings[i:]
+        if self._positions is None:
+            self._docIDs.extend(other._docIDs[i:])
+            return
+        # The positions of the first i postings of `other` go in the last posting of this list
+        self._positions.extend(other._positions[:other._offsets[i]])
+        self._offsets[-1] = len(self._positions)
+        shift = len(self._positions) - other._offsets[i]
+        self._docIDs.extend(other._docIDs[i:])
+        self._positions.extend(other._positions[other._offsets[i]:])
+        self._offsets.extend(o + shift for o in other._offsets[i+1:])
+
+    def _select(self, indices: list) -> 'PostingList':
+        """ Returns a new posting list with only the postings of this one in the given (sorted) indices.
+        """
+        docIDs = array('i', [self._docIDs[i] for i in indices])
+        if self._positions is None:
+            return PostingList.from_arrays(docIDs)
+        positions = array('i')
+        offsets = array('i', [0])
+        for i in indices:
+            positions.extend(self._positions[self._offsets[i]:self._offsets[i+1]])
+            offsets.append(len(positions))
+        return PostingList.from_arrays(docIDs, positions, offsets)
         
     def intersection(self, other: 'PostingList'):
         """ Returns a new posting list resulting from the intersection
         of this one and the one passed as argument.
         """
-        intersection = []
-        i = 0; j = 0
-        while (i < len(self._postings) and j < len(other._postings)):  # until we reach the end of a posting list
-            if (self._postings[i] == other._postings[j]):
-                intersection.append(self._postings[i])
-                i += 1;  j += 1
-            elif (self._postings[i] < other._postings[j]):
-                i += 1
-            else:
-                j += 1
-        return PostingList.from_posting_list(intersection)
+        if isinstance(other, NegatedPostingList):   # x AND NOT y is the difference between x and y
+            return self.difference(other._plist)
+        if isinstance(other, BitmapPostingList):
+            return self._filter(other, True)
+        docs1 = self._docIDs;  docs2 = other._docIDs
+        if min(len(docs1), len(docs2)) * self._galloping_ratio <= max(len(docs1), len(docs2)):
+            return self._galloping_intersection(other)
+        # The set is built on the shortest list and the longest one is only scanned: both are done in C, without comparing the postings one by one
+        if len(docs1) <= len(docs2):
+            common = set(docs1).intersection(docs2)
+        else:
+            common = set(docs2).intersection(docs1)
+        if self._positions is None:
+            return PostingList.from_arrays(array('i', sorted(common)))
+        return self._select([i for i, docID in enumerate(docs1) if docID in common])  # we keep the positions of this posting list
+    
+    def _galloping_intersection(self, other: 'PostingList'):
+        """ Intersection for posting lists of very different lengths: for each docID of the shortest list
+        we jump ahead in the longest one with `gallop`, so we never walk the longest list element by element
+        and the cost is proportional to the length of the shortest one.
+        """
+        intersection = []   # indices of the postings of this list that are also in the other one
+        if len(self._docIDs) <= len(other._docIDs):
+            j = 0
+            for i, docID in enumerate(self._docIDs):
+                j = gallop(other._docIDs, docID, j)
+                if j == len(other._docIDs):
+                    break
+                if other._docIDs[j] == docID:
+                    intersection.append(i)
+        else:
+            i = 0
+            for docID in other._docIDs:
+                i = gallop(self._docIDs, docID, i)
+                if i == len(self._docIDs):
+                    break
+                if self._docIDs[i] == docID:
+                    intersection.append(i)
+        return self._select(intersection)
     
     def union(self, other: 'PostingList'):
         """ Returns a new posting list resulting from the union of this
         one and the one passed as argument.
         """
-        union = []
+        if isinstance(other, NegatedPostingList) or isinstance(other, BitmapPostingList):
+            return other.union(self)
+        if self._positions is None or other._positions is None:   # without positions we only need the union of the docIDs
+            return PostingList.from_arrays(array('i', sorted(set(self._docIDs).union(other._docIDs))))
+        union = []   # pairs (posting list, index) of the postings in the union
+        docs1 = self._docIDs;  docs2 = other._docIDs
         i = 0; j = 0
-        while (i < len(self._postings) and j < len(other._postings)):
-            if (self._postings[i] == other._postings[j]):
-                union.append(self._postings[i])
+        while (i < len(docs1) and j < len(docs2)):
+            if (docs1[i] == docs2[j]):
+                union.append((self, i))
                 i += 1;  j += 1
-            elif (self._postings[i] < other._postings[j]):
-                union.append(self._postings[i])   # because i is the smallest one
+            elif (docs1[i] < docs2[j]):
+                union.append((self, i))   # because i is the smallest one
                 i += 1
             else:
-                union.append(other._postings[j]) 
+                union.append((other, j))
                 j += 1
-        for k in range(i, len(self._postings)):  # we have to append the remaining elements of the non emptied list
-            union.append(self._postings[k])
-        for k in range(j, len(other._postings)):
-            union.append(other._postings[k])
-        return PostingList.from_posting_list(union)
+        union.extend((self, k) for k in range(i, len(docs1)))  # we have to append the remaining elements of the non emptied list
+        union.extend((other, k) for k in range(j, len(docs2)))
+        docIDs = array('i', [plist._docIDs[k] for plist, k in union])
+        positions = array('i')
+        offsets = array('i', [0])
+        for plist, k in union:
+            positions.extend(plist._positions[plist._offsets[k]:plist._offsets[k+1]])
+            offsets.append(len(positions))
+        return PostingList.from_arrays(docIDs, positions, offsets)
+
+    def difference(self, other: 'PostingList'):
+        """ Returns a new posting list with the postings of this one whose
+        docID is not in the one passed as argument (i.e. this one NOT the other one).
+        It takes linear time and it doesn't modify nor copy the two posting lists.
+        """
+        if isinstance(other, NegatedPostingList):   # x NOT (NOT y) is the intersection of x and y
+            return self.intersection(other._plist)
+        if isinstance(other, BitmapPostingList):
+            return self._filter(other, False)
+        if self._positions is None:
+            return PostingList.from_arrays(array('i', sorted(set(self._docIDs).difference(other._docIDs))))
+        excluded = set(other._docIDs)
+        return self._select([i for i, docID in enumerate(self._docIDs) if docID not in excluded])
+
+    def without_positions(self) -> 'PostingList':
+        """ Returns a posting list with the same docIDs of this one but without the positions (the array
+        of the docIDs is shared, not copied). The boolean queries only need the docIDs, and posting lists
+        without positions are intersected and unified with set operations. If the list is dense, the result
+        is a `BitmapPostingList`, which is built only the first time.
+        """
+        docs = self._docIDs
+        if len(docs) >= self._bitmap_min_length and len(docs) * self._bitmap_density > docs[-1]:
+            bitmap = self.__dict__.get('_bitmap_list')
+            if bitmap is None:
+                bitmap = self._bitmap_list = BitmapPostingList.from_docIDs(docs)
+            return bitmap
+        return PostingList.from_arrays(docs)
+
+    def _filter(self, bitmap: 'BitmapPostingList', keep: bool) -> 'PostingList':
+        """ Returns a new posting list with the postings of this one whose docID is (if `keep`) or is not in the bitmap.
+        """
+        bits = bitmap._bytes()
+        limit = 8 * len(bits)
+        indices = [i for i, docID in enumerate(self._docIDs) if (docID < limit and bits[docID >> 3] >> (docID & 7) & 1) == keep]
+        if self._positions is None:
+            return PostingList.from_arrays(array('i', [self._docIDs[i] for i in indices]))
+        return self._select(indices)
 
     def positional_search(self, other: 'PostingList', step: int = 1):
         """ Returns a new posting list resulting from the intersection
         of this one and the one passed as argument.
         """
-        match = []
+        docIDs = array('i')
+        positions = array('i')
+        offsets = array('i', [0])
+        docs1 = self._docIDs;  docs2 = other._docIDs
         i = j = 0
-        while (i < len(self._postings) and j < len(other._postings)):  # until we reach the end of a posting list
-            if (self._postings[i] == other._postings[j]):
-                n = m = u = 0
-                while (n < len(self._postings[i]._positions) and m < len(other._postings[j]._positions)):
-                    if (self._postings[i]._positions[n] + step == other._postings[j]._positions[m]):
-                        if u == 0:
-                            match.append(Posting(self._postings[i]._docID, self._postings[i]._positions[n]))
-                            u = 1
-                        else:
-                            match[-1].add(self._postings[i]._positions[n])
+        while (i < len(docs1) and j < len(docs2)):  # until we reach the end of a posting list
+            if (docs1[i] == docs2[j]):
+                pos1 = self._positions[self._offsets[i]:self._offsets[i+1]]
+                pos2 = other._positions[other._offsets[j]:other._offsets[j+1]]
+                n = m = 0
+                while (n < len(pos1) and m < len(pos2)):
+                    if (pos1[n] + step == pos2[m]):
+                        positions.append(pos1[n])
                         n += 1;  m += 1
-                    elif (self._postings[i]._positions[n] < other._postings[j]._positions[m]):
+                    elif (pos1[n] + step < pos2[m]):
                         n += 1
                     else:
                         m += 1
+                if len(positions) > offsets[-1]:   # we found at least a match in this document
+                    docIDs.append(docs1[i])
+                    offsets.append(len(positions))
+                i += 1;  j += 1
+            elif (docs1[i] < docs2[j]):
+                i += 1
+            else:
+                j += 1
+        return PostingList.from_arrays(docIDs, positions, offsets)
+
+    def proximity_search(self, other: 'PostingList', k: int, ordered: bool = True):
+        """ Returns a new posting list with the postings of this one and the positions followed by a position
+        of the one passed as argument with at most k words in between (the union of `positional_search` with
+        the steps from 1 to k+1). If not `ordered` the position of the other one can also come before.
+        The positions of each document are scanned once, whatever k is: the positions of the other list
+        before the window of the current position are skipped, and they are before the next windows too.
+        """
+        docIDs = array('i')
+        positions = array('i')
+        offsets = array('i', [0])
+        docs1 = self._docIDs;  docs2 = other._docIDs
+        i = j = 0
+        while (i < len(docs1) and j < len(docs2)):
+            if (docs1[i] == docs2[j]):
+                pos1 = self._positions[self._offsets[i]:self._offsets[i+1]]
+                pos2 = other._positions[other._offsets[j]:other._offsets[j+1]]
+                m = 0
+                for p in pos1:
+                    start = p + 1 if ordered else p - k - 1   # the window of the positions of the other list
+                    while m < len(pos2) and pos2[m] < start:
+                        m += 1
+                    n = m
+                    if n < len(pos2) and pos2[n] == p:   # the same word (like in 'love /3 love') doesn't count
+                        n += 1
+                    if n < len(pos2) and pos2[n] <= p + k + 1:
+                        positions.append(p)
+                if len(positions) > offsets[-1]:   # we found at least a match in this document
+                    docIDs.append(docs1[i])
+                    offsets.append(len(positions))
                 i += 1;  j += 1
-            elif (self._postings[i] < other._postings[j]):
+            elif (docs1[i] < docs2[j]):
                 i += 1
             else:
                 j += 1
-        return PostingList.from_posting_list(match)
+        return PostingList.from_arrays(docIDs, positions, offsets)
     
     def get_from_corpus(self, corpus):
         """ Used to retrieve the documents from the docIDs, like when we have a
         posting list that is the result of a query.
         """
-        return list(map(lambda x: x.get_from_corpus(corpus), self._postings))  # I return a list of documents
+        return [corpus[docID] for docID in self._docIDs]  # I return a list of documents
     
     def __getitem__(self, key):
-        return self._postings[key]
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        posting = Posting(self._docIDs[key])
+        if self._positions is not None:
+            key = range(len(self))[key]   # to support negative indices
+            posting._positions = list(self._positions[self._offsets[key]:self._offsets[key+1]])
+        return posting
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
     
     def __len__(self):
-        return len(self._postings)
+        if '_encoded' in self.__dict__:
+            return self._encoded[3]  # we don't need to decode it
+        return len(self._docIDs)
     
     def __repr__(self):
-        return "\n".join(map(str, self._postings))
+        return "\n".join(map(str, self))
+
+"""A `NegatedPostingList` is the NOT of a posting list, i.e. the list of all the documents of the corpus that are not in a given posting list. Computing it explicitly means copying almost all `complete_plist`, so it is computed (with `materialize`) only when we need its documents: when it is combined with another posting list we apply the De Morgan's laws, e.g. `x AND NOT y` is just the difference between `x` and `y` and `NOT x OR NOT y` is `NOT (x AND y)`.
+"""
+
+class NegatedPostingList:
+
+    _plist: PostingList
+    _complete_plist: PostingList
+
+    def __init__(self, plist: PostingList, complete_plist: PostingList):
+        """ Class constructor.
+        Fields:
+          _plist          -- the posting list that is negated
+          _complete_plist -- PostingList containing all the documents of the corpus
+        """
+        self._plist = plist
+        self._complete_plist = complete_plist
+
+    def materialize(self) -> PostingList:
+        """ Returns the posting list with all the documents that are not in `_plist`.
+        """
+        return self._complete_plist.difference(self._plist)
+
+    def intersection(self, other):
+        if isinstance(other, NegatedPostingList):   # NOT x AND NOT y = NOT (x OR y)
+            return NegatedPostingList(self._plist.union(other._plist), self._complete_plist)
+        return other.difference(self._plist)        # NOT x AND y = y NOT x
+
+    def union(self, other):
+        if isinstance(other, NegatedPostingList):   # NOT x OR NOT y = NOT (x AND y)
+            return NegatedPostingList(self._plist.intersection(other._plist), self._complete_plist)
+        return NegatedPostingList(self._plist.difference(other), self._complete_plist)  # NOT x OR y = NOT (x NOT y)
+
+    def difference(self, other):
+        if isinstance(other, NegatedPostingList):   # NOT x NOT (NOT y) = y NOT x
+            return other._plist.difference(self._plist)
+        return NegatedPostingList(self._plist.union(other), self._complete_plist)  # NOT x NOT y = NOT (x OR y)
+
+    def without_positions(self) -> 'NegatedPostingList':
+        return NegatedPostingList(self._plist.without_positions(), self._complete_plist)
+
+    def get_from_corpus(self, corpus):
+        return self.materialize().get_from_corpus(corpus)
+
+    def __len__(self):
+        return len(self._complete_plist) - len(self._plist)
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+"""### Bitmaps
+
+The posting lists of the most frequent words (like "a" and "the") and `complete_plist` contain a large part of the documents. For the boolean queries, which only need the docIDs, such a dense list is better stored as a **<font color=#00ADEF>bitmap</font>**, with a bit for each docID: a Python `int` can be used as a bitmap of any length, and the AND, OR and NOT of two bitmaps are the operators `&`, `|` and `& ~`, computed in C on 30 bits at a time. A bitmap takes 1 bit for each docID up to the last one, while an array takes 32 bits for each posting, so `without_positions` returns a `BitmapPostingList` when the list has at least a document every `_bitmap_density` docIDs, and a normal `PostingList` otherwise. The operations between a bitmap and a sparse list look up the docIDs of the sparse list in the bitmap, and the NOT of a word is the difference between the bitmap of `complete_plist` and the one of the word. The positions are lost, so the bitmaps are used only by the boolean queries.
+"""
+
+_BYTE_BITS = [tuple(j for j in range(8) if byte >> j & 1) for byte in range(256)]  # the bits set in each byte
+
+class BitmapPostingList(PostingList):
+
+    _bitmap: int
+
+    def __init__(self, bitmap: int):
+        """ Class constructor.
+        Fields:
+          _bitmap -- the bit i is set if the docID i is in the posting list
+        The array of the docIDs is computed only if it is needed (see `__getattr__`), and the positions are None.
+        """
+        self._bitmap = bitmap
+        self._positions = None
+        self._offsets = None
+
+    @classmethod
+    def from_docIDs(cls, docIDs: array) -> 'BitmapPostingList':
+        bits = bytearray(docIDs[-1] // 8 + 1 if docIDs else 0)
+        for docID in docIDs:
+            bits[docID >> 3] |= 1 << (docID & 7)
+        return cls(int.from_bytes(bits, 'little'))
+
+    def __getattr__(self, name):
+        if name != '_docIDs' or '_bitmap' not in self.__dict__:
+            raise AttributeError(name)
+        self._docIDs = array('i', [8*i + j for i, byte in enumerate(self._bytes()) if byte for j in _BYTE_BITS[byte]])
+        return self._docIDs
+
+    def _bytes(self) -> bytes:
+        """ The bitmap as bytes (the bit j of the byte i is the docID 8i+j), to look up single docIDs.
+        """
+        bits = self.__dict__.get('_bits')
+        if bits is None:
+            bits = self._bits = self._bitmap.to_bytes((self._bitmap.bit_length() + 7) // 8, 'little')
+        return bits
+
+    def intersection(self, other):
+        if isinstance(other, NegatedPostingList):
+            return self.difference(other._plist)
+        if isinstance(other, BitmapPostingList):
+            return BitmapPostingList(self._bitmap & other._bitmap)
+        return other._filter(self, True)
+
+    def union(self, other):
+        if isinstance(other, NegatedPostingList):
+            return other.union(self)
+        if isinstance(other, BitmapPostingList):
+            return BitmapPostingList(self._bitmap | other._bitmap)
+        return BitmapPostingList(self._bitmap | BitmapPostingList.from_docIDs(other._docIDs)._bitmap)
+
+    def difference(self, other):
+        if isinstance(other, NegatedPostingList):
+            return self.intersection(other._plist)
+        if not isinstance(other, BitmapPostingList):
+            other = BitmapPostingList.from_docIDs(other._docIDs)
+        return BitmapPostingList(self._bitmap & ~other._bitmap)
+
+    def without_positions(self) -> 'BitmapPostingList':
+        return self
+
+    def __len__(self):
+        return self._bitmap.bit_count()
 
 """## Terms
 
@@ -277,6 +698,13 @@ def tokenize(movie: 'MovieDescription') -> list:
     text = normalize(movie.description)
     return list(text.split())
 
+def tokenize_all(documents):
+    """ Generator of the tokens of each document: a stage of the pipeline building the index, which reads
+    and tokenizes the documents one at a time.
+    """
+    for document in documents:
+        yield tokenize(document)
+
 """Function to print a progress bar, taken from [here](https://stackoverflow.com/questions/3160699/python-progress-bar)."""
 
 import time, sys
@@ -307,11 +735,15 @@ def update_progress(progress):
 
 """In an **<font color=#00ADEF>inverted index</font>** we store, for each term, the list of documents containing it.\
 In a **<font color=#00ADEF> positional index</font>** we add, for each posting, the set of positions in which the term appears in the document.\
-In a **<font color=#00ADEF>permuterm index</font>** for each word we insert a special “end of word” symbol, \$, and we insert all the rotations of the word (including the “end of word”) in the dictionary. All the rotations of the same word points to the **same** postings list of the initial word.
+In a **<font color=#00ADEF>permuterm index</font>** for each word we insert a special “end of word” symbol, \$, and we consider all the rotations of the word (including the “end of word”). All the rotations of the same word points to the **same** postings list of the initial word.
 
-So an `Index` object, which implements all these three indexes, contains a list `_dictionary` of `Term`s, which, we recall, contains the `PostingList` associated to the word. It's created from a dictionary with as keys the words themselves and as values the `Term` associated to that word, from which the values are taken and inserted sorted in the variable.\
+So an `Index` object, which implements all these three indexes, contains a list `_dictionary` of `Term`s, which, we recall, contains the `PostingList` associated to the word, sorted alphabetically.\
+The rotations are not stored as strings (there are as many rotations of a word as its characters, plus one): the permuterm index is made of two arrays, `_permuterm_terms` and `_permuterm_shifts`, with the termID of the word and the shift of each rotation, sorted in alphabetical order of the rotations (like a suffix array of the vocabulary). `rotation` computes the string of a rotation only when we need it.\
+The posting lists are built with the **<font color=#00ADEF>blocked sort-based indexing</font>** (BSBI) algorithm: we read the corpus collecting the (termID, docID, position) triples in arrays; when a block is full we sort it by term, we build the posting lists of the block and we write them on a temporary file (a *run*), sorted by term. At the end we perform a multiway merge of all the runs (see `write_block` and `merge_runs`), so the memory used during the construction is bounded by the size of a block.\
+Since scanning `_dictionary` for every word of a query is too slow, we also keep the hash table `_lookup`, which maps each word directly to its `PostingList`: it is built once in `from_corpus` and pickled together with the rest of the index, so `__getitem__` costs O(1).\
 It also stores a list with all the Postings, `complete_plist`, used to answer the NOT queries.\
-The variable `_reverse_dictionary` contains the same words of `_dictionary` but ordered alphabetically starting from the end of the word to the beginning; it is used to answer leading wildcards.
+The variable `_reverse_dictionary` contains the same words of `_dictionary` but ordered alphabetically starting from the end of the word to the beginning; it is used to answer leading wildcards.\
+Optionally (see the argument `biword_threshold` of `from_corpus`) the index contains also a **<font color=#00ADEF>biword index</font>**: `_biwords` maps the pairs of consecutive words found in many documents (like "new york") to a `PostingList` with the positions where the pair starts. The phrase queries use it to answer the phrases of two words without merging positions, and to find the few candidate documents of the longer phrases.
 
 Both `list.sort()` and `sorted()` have a `key` parameter to specify a function (or other callable) to be called on each list element prior to making comparisons [see [link](https://docs.python.org/3/howto/sorting.html)].
 """
@@ -320,6 +752,13 @@ class Index:
 
     _dictionary: List[Term]
     _reverse_dictionary: List[Term]
+    _lookup: dict
+    _permuterm_terms: array
+    _permuterm_shifts: array
+    _deltas: List['Index']
+    _deleted: PostingList
+    _vocabulary: 'Vocabulary'
+    _biwords: dict
     complete_plist: PostingList
     
     def __init__(self):
@@ -327,61 +766,412 @@ class Index:
         Fields:
           _dictionary          -- the collection of all terms that we have in the index
           _reverse_dictionary  -- the dictionary with in alphabetical order the reverse of the words
-          complete_plist       -- PostingList containing all the documents of the corpus
+          _lookup              -- hash table from each term to its PostingList, used by __getitem__
+          _permuterm_terms     -- the termID (the index in `_dictionary`) of each rotation of the permuterm index, in alphabetical order of the rotations
+          _permuterm_shifts    -- the shift of each rotation, i.e. the number of characters of "word$" moved at the end
+          _deltas              -- the indexes of the documents added later: _deltas[i] is None or it contains 2^i additions
+          _deleted             -- PostingList with the docIDs of the deleted documents (the tombstones)
+          _vocabulary          -- Vocabulary with the words of `_dictionary`, used by the spelling correction
+          _biwords             -- hash table from the frequent pairs of consecutive words ("w1 w2") to their PostingList (empty if there is no biword index)
+          complete_plist       -- PostingList containing all the documents of the corpus (but the deleted ones)
         '''
         self._dictionary = []
         self._reverse_dictionary = []
+        self._lookup = {}
+        self._permuterm_terms = array('i')
+        self._permuterm_shifts = array('i')
+        self._deltas = []
+        self._deleted = PostingList()
+        self._vocabulary = Vocabulary([], array('i'), array('i', [0]), array('q'))
+        self._biwords = {}
         self.complete_plist = PostingList()
         
     @classmethod  # to have multiple constructors. It's like a static method in Java: you call Index.from_corpus()
-    def from_corpus(cls, corpus: list):
+    def from_corpus(cls, corpus: list, block_size: int = 1000000, workers: int = 1, biword_threshold: int = None):
         ''' Class constructor processing a corpus. This is the constructor that creates the index from scatch given a corpus of documents.
+        Arguments:
+          block_size       -- number of (termID, docID, position) triples in a block of the BSBI algorithm
+          workers          -- number of processes that build the index in parallel (only with the "fork" start method, see below)
+          biword_threshold -- if given, the pairs of consecutive words found in at least this number of documents are added to the biword index
         '''
-        # Here we "cheat" by using python dictionaries (we should create a big list, sort it and merge everything)
-        intermediate_dict = {}
         print("Processing the corpus to create the index...")
-        for docID, document in enumerate(corpus): # NB: corpus → list of objects of type MovieDescription
-            # Update complete_plist
-            if docID == 0:
-                compl_plist = PostingList.from_docID(docID)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # With the "spawn" start method (the only one on Windows) every worker would import again this whole script, reading the
+            # corpus, building the index and answering the test queries, so without "fork" the index is built by this process.
+            parallel = workers > 1 and "fork" in multiprocessing.get_all_start_methods()
+            if not parallel or len(corpus) < workers:  # a corpus smaller than the number of workers is not worth splitting (and it could be empty)
+                runs, n_docs = index_shard(corpus, 0, block_size, os.path.join(tmpdir, "shard0"), progress=True)
             else:
-                compl_plist.merge(PostingList.from_docID(docID))
-            # Update _dictionary
-            tokens = tokenize(document) # `document` is a MovieDescription object
-            for pos, token in enumerate(tokens):
-                term = Term.given_docid(token, docID, pos)
-                try:
-                    intermediate_dict[token].merge(term)  # I merge the two posting lists → Term.merge() which calls PostingList.merge()
-                except KeyError:
-                    intermediate_dict[token] = term  # when the term is not present in the dictionary
-                    token = token + "$" # insert the special "end of word" symbol
-                    rotations = word_rotations(token) # compute all the possible rotations of the word
-                    for r in rotations:
-                        term = Term.given_posting_list(r, term.posting_list) # since python doesn't perform deepcopy this is a reference to "term.posting_list", so a "pointer"
-                        intermediate_dict[r] = term
-
-            # To observe the progressing of our indexing
-            update_progress(docID/len(corpus))
-        
+                # The corpus is split in `workers` shards of consecutive documents, so the docIDs of the shards are disjoint
+                # and increasing, and the runs of the shards can be merged like the runs of a single process.
+                context = multiprocessing.get_context("fork")
+                shard_size = -(-len(corpus) // workers)  # rounded up
+                with ProcessPoolExecutor(workers, mp_context=context) as executor:
+                    futures = [executor.submit(index_shard, corpus[first:first+shard_size], first, block_size, os.path.join(tmpdir, f"shard{n}"))
+                               for n, first in enumerate(range(0, len(corpus), shard_size))]
+                    results = [future.result() for future in futures]
+                runs = [run for shard_runs, _ in results for run in shard_runs]
+                n_docs = sum(shard_docs for _, shard_docs in results)
+
+            idx = cls.from_posting_lists(merge_runs(runs), PostingList.from_arrays(array('i', range(n_docs))))
+        if biword_threshold is not None:
+            idx._biwords = biword_index(corpus, idx, biword_threshold)
+        return idx
+
+    @classmethod
+    def from_posting_lists(cls, postings, complete_plist: PostingList) -> 'Index':
+        ''' Class constructor given the (word, PostingList) pairs of the index and the PostingList with all the documents.
+        It sorts the rotations of the words for the permuterm index.
+        '''
         idx = cls()  # we call the constructor of the class Index
-        idx._dictionary = sorted(intermediate_dict.values())  # list of all the sorted terms
-        idx._reverse_dictionary = sorted(intermediate_dict.values(), key=lambda x: backwards(x.term))
-        idx.complete_plist = compl_plist
+        idx._dictionary = sorted(Term.given_posting_list(token, plist) for token, plist in postings)  # list of all the sorted terms
+        idx._reverse_dictionary = sorted(idx._dictionary, key=lambda x: backwards(x.term))
+        idx._lookup = {t.term: t.posting_list for t in idx._dictionary}  # built only once, then saved with the index
+        # The rotations are not sorted all together: they are grouped by their first two characters (every word has
+        # at least two characters with the special "end of word" symbol), and only the rotations of one group at a time
+        # are built as strings, to sort them
+        words = [t.term + "$" for t in idx._dictionary]
+        groups = {}
+        for termID, word in enumerate(words):
+            for shift in range(len(word)):
+                prefix = word[shift:shift+2] if shift + 1 < len(word) else word[shift] + word[0]
+                group = groups.get(prefix)
+                if group is None:
+                    group = groups[prefix] = (array('i'), array('i'))
+                group[0].append(termID)
+                group[1].append(shift)
+        idx._permuterm_terms = array('i')
+        idx._permuterm_shifts = array('i')
+        for prefix in sorted(groups):
+            termIDs, shifts = groups.pop(prefix)
+            order = sorted(range(len(termIDs)), key=lambda k: words[termIDs[k]][shifts[k]:] + words[termIDs[k]][:shifts[k]])
+            idx._permuterm_terms.extend(termIDs[k] for k in order)
+            idx._permuterm_shifts.extend(shifts[k] for k in order)
+        idx._vocabulary = Vocabulary.from_words([t.term for t in idx._dictionary])
+        idx.complete_plist = complete_plist
         return idx
+
+    @classmethod
+    def from_documents(cls, documents: list, first_docID: int) -> 'Index':
+        ''' Class constructor for a few documents, with docIDs starting from `first_docID`, which builds the index
+        directly in memory (used for the documents added to an index).
+        '''
+        postings = {}
+        for docID, document in enumerate(documents, first_docID):
+            for pos, token in enumerate(tokenize(document)):
+                plist = postings.get(token)
+                if plist is None:
+                    postings[token] = PostingList.from_docID(docID, pos)
+                else:
+                    plist.add(docID, pos)
+        return cls.from_posting_lists(postings.items(), PostingList.from_arrays(array('i', range(first_docID, first_docID + len(documents)))))
+
+    @classmethod
+    def from_indexes(cls, indexes: List['Index'], deleted: PostingList) -> 'Index':
+        ''' Class constructor merging indexes of consecutive documents (the first index has the lowest docIDs),
+        without the deleted documents.
+        '''
+        words = heapq.merge(*[idx._dictionary for idx in indexes], key=lambda t: t.term)
+        postings = []
+        for word, terms in groupby(words, key=lambda t: t.term):
+            plist = concatenate([t.posting_list for t in terms])
+            if deleted:
+                plist = plist.difference(deleted)
+            if plist:  # all the documents of the word could have been deleted
+                postings.append((word, plist))
+        complete_plist = concatenate([idx.complete_plist for idx in indexes]).difference(deleted)
+        return cls.from_posting_lists(postings, complete_plist)
     
     def __getitem__(self, key):
         ''' Indexes the index using as keys the Terms.
         '''
-        for term in self._dictionary:  # TODO: binary search
-            if term.term == key:
-                return term.posting_list  # quering the index with a  word returns the PostingList associated to that word
-        raise KeyError(f"The term '{key}' is not present in the index.") # the key is not present!
+        if not self._deltas and not self._deleted:
+            try:
+                return self._lookup[key]  # quering the index with a  word returns the PostingList associated to that word
+            except KeyError:
+                raise KeyError(f"The term '{key}' is not present in the index.") from None # the key is not present!
+        # The posting lists of the documents added later are appended, and the deleted documents are removed
+        postings = [idx._lookup[key] for idx in self._generations() if key in idx._lookup]
+        if not postings:
+            raise KeyError(f"The term '{key}' is not present in the index.")
+        plist = concatenate(postings)
+        return plist.difference(self._deleted) if self._deleted else plist
+
+    def rotation(self, i: int) -> str:
+        ''' Returns the i-th rotation of the permuterm index (in alphabetical order), computed from its word.
+        '''
+        word = self._dictionary[self._permuterm_terms[i]].term + "$"
+        shift = self._permuterm_shifts[i]
+        return word[shift:] + word[:shift]
+
+    def rotations(self, indexes: range = None):
+        ''' Generator of the (rotation, word) pairs of the permuterm index in the given range of indexes (all of them
+        by default), in alphabetical order of the rotations.
+        '''
+        if indexes is None:
+            indexes = range(len(self._permuterm_terms))
+        for i in indexes:
+            yield self.rotation(i), self._dictionary[self._permuterm_terms[i]].term
+
+    def prefix_range(self, prefix: str) -> range:
+        ''' Returns the range of the indexes of the rotations starting with the prefix. Since the rotations are sorted
+        they are contiguous, and we find the first and the last one with two binary searches in O(log n).
+        '''
+        n = len(self._permuterm_terms)
+        lo = bisect_left(range(n), prefix, key=self.rotation)
+        hi = bisect_right(range(n), prefix, lo, key=lambda i: self.rotation(i)[:len(prefix)])  # the rotations truncated to the length of the prefix are sorted too
+        return range(lo, hi)
+
+    def suffix_range(self, suffix: str) -> range:
+        ''' Returns the range of the indexes in `_reverse_dictionary` of the words ending with the suffix. The words are sorted
+        by their reverse, so they are contiguous and we find them with two binary searches on the reversed words.
+        '''
+        reversed_suffix = backwards(suffix)
+        lo = bisect_left(self._reverse_dictionary, reversed_suffix, key=lambda t: backwards(t.term))
+        hi = bisect_right(self._reverse_dictionary, reversed_suffix, lo, key=lambda t: backwards(t.term)[:len(suffix)])
+        return range(lo, hi)
+
+    def nearest_words(self, words: List[str]) -> List[str]:
+        ''' Returns the nearest word of the index to each of the given words (see `Vocabulary.nearest_words`). The indexes
+        of the added documents have their own vocabularies, and we take the nearest word found in all of them. The words
+        whose documents have all been deleted are skipped.
+        '''
+        accept = self.__contains__ if self._deleted else None
+        nearest = [(float('inf'), None)] * len(words)
+        for idx in self._generations():
+            nearest = [found if found[1] is not None and found < n else n for n, found in zip(nearest, idx._vocabulary.nearest_words(words, accept))]
+        return [w for _, w in nearest]
+
+    def biword(self, word1: str, word2: str) -> PostingList:
+        ''' Returns the PostingList of the pair of consecutive words from the biword index (with the documents added
+        later and without the deleted ones), or None if the pair is not in the biword index.
+        '''
+        plist = self._biwords.get(word1 + " " + word2)
+        if plist is None or (not self._deltas and not self._deleted):
+            return plist
+        postings = [plist] + [phrase_search([idx._lookup[word1], idx._lookup[word2]]) for idx in self._generations()[1:]
+                              if word1 in idx._lookup and word2 in idx._lookup]   # the pairs of the added documents
+        plist = concatenate(postings)
+        return plist.difference(self._deleted) if self._deleted else plist
+
+    def phrase(self, words: List[str]) -> PostingList:
+        ''' Returns the PostingList of the phrase made of the given (normalized) words, with the positions where it
+        starts. The pairs of consecutive words in the biword index are searched with their posting lists, which are
+        shorter than the ones of their words, and the positions of the other words are checked by `phrase_search`.
+        '''
+        postings = []
+        phrase_offsets = []
+        covered = set()  # the positions of the words of the biwords
+        for i in range(len(words) - 1):
+            biword = self.biword(words[i], words[i+1])
+            if biword is not None:
+                postings.append(biword)
+                phrase_offsets.append(i)
+                covered.update((i, i+1))
+        for i, w in enumerate(words):
+            if i not in covered:
+                postings.append(self[w])
+                phrase_offsets.append(i)
+        return phrase_search(postings, phrase_offsets)
+
+    def _generations(self) -> List['Index']:
+        ''' Returns this index and the indexes of the documents added later, from the oldest one.
+        '''
+        return [self] + [delta for delta in reversed(self._deltas) if delta is not None]
+
+    def add_documents(self, documents: list, first_docID: int):
+        ''' Adds the documents to the index, with docIDs starting from `first_docID` (higher than all the docIDs
+        of the index). The new documents go in a small index which is merged with the ones of the previous
+        additions with a logarithmic merging: _deltas[i] contains 2^i additions, so each posting is merged
+        O(log n) times. When the merged documents are as many as the ones of this index everything is compacted.
+        '''
+        delta = Index.from_documents(documents, first_docID)
+        self.complete_plist = concatenate([self.complete_plist, delta.complete_plist])
+        level = 0
+        while level < len(self._deltas) and self._deltas[level] is not None:
+            delta = Index.from_indexes([self._deltas[level], delta], self._deleted)
+            self._deltas[level] = None
+            level += 1
+        if level == len(self._deltas):
+            self._deltas.append(None)
+        self._deltas[level] = delta
+        if len(delta.complete_plist) >= len(self.complete_plist) - len(delta.complete_plist):
+            self.compact()
+
+    def delete_documents(self, docIDs: List[int]):
+        ''' Deletes the documents from the index. The docIDs are kept in `_deleted` (the tombstones) and they are removed
+        from the results of the lookups, until the index is compacted.
+        '''
+        deleted = PostingList.from_arrays(array('i', sorted(docIDs)))
+        self._deleted = self._deleted.union(deleted)
+        self.complete_plist = self.complete_plist.difference(deleted)  # so the NOT queries don't return the deleted documents
+
+    def compact(self):
+        ''' Merges the indexes of the added documents in this index and removes the deleted documents.
+        '''
+        if not self._deltas and not self._deleted:
+            return
+        biwords = {pair: self.biword(*pair.split()) for pair in self._biwords}
+        idx = Index.from_indexes(self._generations(), self._deleted)
+        self._dictionary = idx._dictionary
+        self._reverse_dictionary = idx._reverse_dictionary
+        self._lookup = idx._lookup
+        self._permuterm_terms = idx._permuterm_terms
+        self._permuterm_shifts = idx._permuterm_shifts
+        self._vocabulary = idx._vocabulary
+        self._biwords = {pair: plist for pair, plist in biwords.items() if plist}
+        self.complete_plist = idx.complete_plist
+        self._deltas = []
+        self._deleted = PostingList()
         
+    @classmethod
+    def from_file(cls, filename: str) -> 'Index':
+        ''' Class constructor opening an index saved with `save`. The file is mapped in memory, and the terms
+        and the posting lists are read from it only when they are used.
+        '''
+        index_file = IndexFile(filename)
+        idx = cls()
+        idx._dictionary = TermSequence(index_file)
+        idx._reverse_dictionary = TermSequence(index_file, index_file._reverse)
+        idx._lookup = TermLookup(index_file)
+        idx._permuterm_terms = index_file._permuterm_terms
+        idx._permuterm_shifts = index_file._permuterm_shifts
+        idx._vocabulary = Vocabulary(WordSequence(index_file), index_file._length_order, index_file._length_offsets, index_file._deletes)
+        idx._biwords = {index_file.biword(i): index_file.posting_list(index_file.complete_plist_id + 1 + i) for i in range(index_file.n_biwords)}
+        idx.complete_plist = index_file.posting_list(index_file.complete_plist_id)
+        return idx
+
+    def compress(self):
+        ''' Keeps all the posting lists of the index compressed in memory (see `PostingList.compress`).
+        '''
+        for t in self._dictionary:
+            t.posting_list.compress()
+        for plist in self._biwords.values():
+            plist.compress()
+
+    def save(self, filename: str):
+        ''' Saves the index in a binary file, that can be opened with `from_file`. The index is compacted first.
+        '''
+        self.compact()
+        IndexFile.write(self, filename)
+
+    def __contains__(self, key):
+        ''' A word is in the index if it is in at least one document that has not been deleted.
+        '''
+        if not self._deleted:
+            return any(key in idx._lookup for idx in self._generations())
+        try:
+            return len(self[key]) > 0  # the words of the deleted documents remain in `_dictionary` until the index is compacted
+        except KeyError:
+            return False
+
     def __repr__(self):
         ''' Representation of the index.
         '''
         return "A dictionary with " + str(len(self._dictionary)) + " terms"
 
+def index_shard(corpus: list, first_docID: int, block_size: int, prefix: str, progress: bool = False):
+    """ Reads a part of the corpus, whose first document has docID `first_docID`, and writes its blocks
+    of the BSBI algorithm on the files starting with `prefix`. Returns the names of the files and the
+    number of documents read.
+    """
+    termIDs = {}   # the ID of each term
+    terms = []     # the term of each ID
+    block = (array('i'), array('i'), array('i'))  # termIDs, docIDs and positions of the block
+    runs = []      # files with the blocks
+    n_docs = 0
+    for n_docs, tokens in enumerate(tokenize_all(corpus), 1): # NB: corpus → sequence of objects of type MovieDescription, read one at a time
+        docID = first_docID + n_docs - 1
+        for pos, token in enumerate(tokens):
+            termID = termIDs.get(token)
+            if termID is None:  # when the term is not present in the dictionary
+                termID = termIDs[token] = len(terms)
+                terms.append(token)
+            block[0].append(termID)
+            block[1].append(docID)
+            block[2].append(pos)
+        if len(block[0]) >= block_size:  # the block is full: we sort it and write it on disk
+            runs.append(f"{prefix}-block{len(runs)}")
+            write_block(terms, *block, runs[-1])
+            block = (array('i'), array('i'), array('i'))
+
+        # To observe the progressing of our indexing
+        if progress:
+            update_progress(n_docs/len(corpus))
+    if block[0]:
+        runs.append(f"{prefix}-block{len(runs)}")
+        write_block(terms, *block, runs[-1])
+    return runs, n_docs
+
+def write_block(terms: List[str], termIDs: array, docIDs: array, positions: array, filename: str):
+    """ Sorts a block of (termID, docID, position) triples by term, builds the posting lists of the
+    block and writes them in the file as (term, PostingList) pairs, in alphabetical order of the terms.
+    """
+    block_terms = sorted(set(termIDs), key=terms.__getitem__)  # the termIDs of the block in alphabetical order
+    rank = {termID: r for r, termID in enumerate(block_terms)}
+    ranks = array('i', map(rank.__getitem__, termIDs))
+    order = sorted(range(len(ranks)), key=ranks.__getitem__)  # the sort is stable, so for each term the docIDs and the positions remain sorted
+    with open(filename, 'wb') as f:
+        plist = None
+        for k in order:
+            if plist is not None and ranks[k] == current:
+                plist.add(docIDs[k], positions[k])
+            else:
+                if plist is not None:
+                    pickle.dump((terms[block_terms[current]], plist), f)
+                current = ranks[k]
+                plist = PostingList.from_docID(docIDs[k], positions[k])
+        if plist is not None:
+            pickle.dump((terms[block_terms[current]], plist), f)
+
+def read_run(filename: str):
+    """ Reads one by one the (term, PostingList) pairs written in a file by `write_block`.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def merge_runs(filenames: List[str]):
+    """ Multiway merge of the blocks written by `write_block`: returns the (term, PostingList) pairs of the whole
+    corpus in alphabetical order, reading from each file only one pair at a time. The blocks must be given in the
+    order of their docIDs (`heapq.merge` is stable) so the posting lists of the same term can be merged one after the other.
+    """
+    records = heapq.merge(*map(read_run, filenames), key=lambda record: record[0])
+    for term, group in groupby(records, key=lambda record: record[0]):
+        _, plist = next(group)
+        for _, other in group:
+            plist.merge(other)
+        yield term, plist
+
+def concatenate(postings: List[PostingList]) -> PostingList:
+    """ Returns a new posting list with the postings of the given posting lists, one after the other: the docIDs
+    of each list must be higher than the ones of the previous lists.
+    """
+    postings = [plist for plist in postings if plist]
+    if not postings:
+        return PostingList()
+    if len(postings) == 1:
+        return postings[0]
+    plist = postings[0]._select(range(len(postings[0])))  # a copy, because `merge` modifies the posting list
+    for other in postings[1:]:
+        plist.merge(other)
+    return plist
+
+def biword_index(corpus: list, index: 'Index', threshold: int) -> dict:
+    """ Returns the biword index of the corpus: a dictionary from the pairs of consecutive words ("w1 w2") found in
+    at least `threshold` documents to their PostingLists. A pair can't be in more documents than its words, so
+    we count in a pass over the corpus only the pairs of words found in at least `threshold` documents, and then
+    we build the posting lists of the frequent pairs from the posting lists of their words.
+    """
+    frequent = {t.term for t in index._dictionary if len(t.posting_list) >= threshold}
+    counts = Counter()
+    for tokens in tokenize_all(corpus):
+        counts.update({(w1, w2) for w1, w2 in zip(tokens, tokens[1:]) if w1 in frequent and w2 in frequent})  # each document is counted once
+    return {w1 + " " + w2: phrase_search([index[w1], index[w2]]) for (w1, w2), n in sorted(counts.items()) if n >= threshold}
+
 def backwards(x):
   return x[::-1]
 
@@ -393,11 +1183,180 @@ def word_rotations(txt):
         rotations.append(second + first)
     return rotations
 
+"""### Index file
+
+Loading the index with `pickle` means building again all its objects in memory, which takes a long time. So the index is saved in a binary file, which contains:
+- a header with the sizes and the positions of the following sections;
+- the terms of `_dictionary`, one after the other, and the offsets where each one starts;
+- the order of the terms in `_reverse_dictionary`;
+- the rotations of the permuterm index, as the termIDs and the shifts of `_permuterm_terms` and `_permuterm_shifts`;
+- the arrays of the `Vocabulary` used by the spelling correction: the termIDs sorted by the length of the words, the offsets of each length and the deletion index;
+- the pairs of the biword index (if any), as strings and their offsets;
+- for each posting list (the one of each term, `complete_plist` and the ones of the biwords), the offset where it starts, its length in bytes, the number of docIDs and the number of positions (-1 when there are no positions);
+- the posting lists, compressed with `PostingList.encode`.
+
+The file is opened with `mmap`, so the operating system loads its pages only when we read them, and different processes using the same index share them. An `IndexFile` reads the terms and the posting lists from the file only when they are needed: `TermSequence` is a sequence of `Term`s (like `_dictionary`) and `TermLookup` finds the posting list of a term with a binary search on the sorted terms (like `_lookup`).
+"""
+
+class IndexFile:
+
+    _header = struct.Struct("<4s4x17q")   # magic number and the sizes and positions of the sections
+
+    def __init__(self, filename: str):
+        """ Class constructor: maps the file in memory and reads the header.
+        """
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # the mapping remains valid after closing the file
+        (magic, self.n_terms, self.n_rotations, self.n_lengths, self.n_deletes, self.n_biwords, strings, term_offsets, reverse, permuterm_terms,
+         permuterm_shifts, length_order, length_offsets, deletes, biword_strings, biword_offsets, plist_table, postings) = self._header.unpack_from(self._mmap)
+        if magic != b"BID2":  # "BIDX" was the format without the deletion index
+            raise ValueError(f"{filename} is not an index file.")
+        view = memoryview(self._mmap)
+        self._strings = strings
+        self._term_offsets = view[term_offsets : term_offsets + 8*(self.n_terms+1)].cast('q')
+        self._reverse = view[reverse : reverse + 4*self.n_terms].cast('i')
+        self._permuterm_terms = view[permuterm_terms : permuterm_terms + 4*self.n_rotations].cast('i')
+        self._permuterm_shifts = view[permuterm_shifts : permuterm_shifts + 4*self.n_rotations].cast('i')
+        self._length_order = view[length_order : length_order + 4*self.n_terms].cast('i')
+        self._length_offsets = view[length_offsets : length_offsets + 4*self.n_lengths].cast('i')
+        self._deletes = view[deletes : deletes + 8*self.n_deletes].cast('q')
+        self._biword_strings = biword_strings
+        self._biword_offsets = view[biword_offsets : biword_offsets + 8*(self.n_biwords+1)].cast('q')
+        self._plist_table = view[plist_table : plist_table + 32*(self.n_terms+1+self.n_biwords)].cast('q')
+        self._postings = postings
+        self._plists = {}  # the posting lists already read from the file
+        self.complete_plist_id = self.n_terms  # the posting list after the ones of the terms, followed by the ones of the biwords
+
+    def term(self, i: int) -> str:
+        start = self._strings + self._term_offsets[i]
+        end = self._strings + self._term_offsets[i+1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def biword(self, i: int) -> str:
+        start = self._biword_strings + self._biword_offsets[i]
+        end = self._biword_strings + self._biword_offsets[i+1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def posting_list(self, p: int) -> PostingList:
+        """ Returns the posting list number p (the one of the term p, or `complete_plist`), always the same object.
+        """
+        try:
+            return self._plists[p]
+        except KeyError:
+            offset, n_bytes, n_docs, n_positions = self._plist_table[4*p : 4*p+4]
+            plist = self._plists[p] = PostingList.from_buffer(self._mmap, self._postings + offset, n_bytes, n_docs, n_positions)
+            return plist
+
+    @staticmethod
+    def write(index: 'Index', filename: str):
+        """ Writes the index in the file.
+        """
+        biwords = sorted(index._biwords.items())
+        plists = [t.posting_list for t in index._dictionary] + [index.complete_plist] + [plist for _, plist in biwords]
+        vocabulary = index._vocabulary  # the index is compacted, so its vocabulary has all the words
+        term_ids = {t.term: i for i, t in enumerate(index._dictionary)}
+        reverse = array('i', [term_ids[t.term] for t in index._reverse_dictionary])
+        strings = [t.term.encode('utf-8') for t in index._dictionary]
+        term_offsets = array('q', [0])
+        for string in strings:
+            term_offsets.append(term_offsets[-1] + len(string))
+        biword_strings = [pair.encode('utf-8') for pair, _ in biwords]
+        biword_offsets = array('q', [0])
+        for string in biword_strings:
+            biword_offsets.append(biword_offsets[-1] + len(string))
+        encoded = [plist.encode() for plist in plists]
+        plist_table = array('q')
+        offset = 0
+        for plist, data in zip(plists, encoded):
+            n_positions = -1 if plist._positions is None else len(plist._positions)
+            plist_table.extend([offset, len(data), len(plist), n_positions])
+            offset += len(data)
+
+        sections = [b"".join(strings), term_offsets.tobytes(), reverse.tobytes(), array('i', index._permuterm_terms).tobytes(),
+                    array('i', index._permuterm_shifts).tobytes(), array('i', vocabulary._length_order).tobytes(),
+                    array('i', vocabulary._length_offsets).tobytes(), array('q', vocabulary._deletes).tobytes(), b"".join(biword_strings), biword_offsets.tobytes(), plist_table.tobytes()]
+        with open(filename, 'wb') as f:
+            positions = []
+            f.seek(IndexFile._header.size)
+            for section in sections:
+                f.write(b"\0" * (-f.tell() % 8))  # we align the sections to 8 bytes
+                positions.append(f.tell())
+                f.write(section)
+            f.write(b"\0" * (-f.tell() % 8))
+            positions.append(f.tell())
+            for data in encoded:
+                f.write(data)
+            f.seek(0)
+            f.write(IndexFile._header.pack(b"BID2", len(strings), len(index._permuterm_terms), len(vocabulary._length_offsets), len(vocabulary._deletes), len(biwords), *positions))
+
+class TermSequence:
+    """ The terms of an `IndexFile` as a sequence of `Term`s, in alphabetical order or in the given order.
+    """
+
+    def __init__(self, index_file: IndexFile, order = None):
+        self._file = index_file
+        self._order = order
+
+    def __getitem__(self, i: int) -> Term:
+        if self._order is not None:
+            i = self._order[i]
+        elif i < 0:
+            i += len(self)
+        return Term.given_posting_list(self._file.term(i), self._file.posting_list(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return self._file.n_terms
+
+class WordSequence:
+    """ The words of an `IndexFile` as a sequence of strings, in alphabetical order (the words of a `Vocabulary`).
+    """
+
+    def __init__(self, index_file: IndexFile):
+        self._file = index_file
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return self._file.term(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return self._file.n_terms
+
+class TermLookup:
+    """ Dictionary from the terms of an `IndexFile` to their posting lists, with a binary search on the sorted terms.
+    """
+
+    def __init__(self, index_file: IndexFile):
+        self._file = index_file
+
+    def __getitem__(self, key: str) -> PostingList:
+        i = bisect_left(range(self._file.n_terms), key, key=self._file.term)
+        if i == self._file.n_terms or self._file.term(i) != key:
+            raise KeyError(key)
+        return self._file.posting_list(i)
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
 """## Reading the Corpus
 
 A `MovieDescription` object has a title and a description.  We have some comparison methods to check if two `MovieDescription`s are equal or one is greater then the other, etc. The function `hash` computes the hash of a `MovieDescription` using the hash of its title and its description.
 
 We have implemented the comparison methods to make `MovieDescription` a sortable object (so we can iterate on it), and the `hash` method to make it hashable (so we can put it in a `set`).
+
+The files of the corpus (plain text, or compressed with gzip as they are downloaded) are read one record at a time by `read_records`, and the descriptions are not kept in memory: `read_movie_descriptions` returns a `Corpus`, which keeps only the title of each movie and the position of its description in the file, and reads the description only when the document is used (like when it is in the result of a query). Every seek backwards in a gzip file decompresses it again from the start, so a compressed file is decompressed only once, in a temporary file that `close` deletes (a `Corpus` can be used in a `with` statement to close it). The index is built from a pipeline of generators: the documents are read one at a time from the `Corpus`, `tokenize_all` tokenizes them and the indexer adds their postings to its blocks, so the text of the whole corpus is never in memory.
 """
 
 @total_ordering
@@ -421,81 +1380,392 @@ class MovieDescription:
     def __repr__(self):
         return self.title  # + "\n" + self.description + "\n"
 
-def read_movie_descriptions():
-    filename = 'data/plot_summaries.txt'
-    movie_names_file = 'data/movie.metadata.tsv'
-    with open(movie_names_file, 'r') as csv_file:
-        movie_names = csv.reader(csv_file, delimiter = '\t')
-        names_table = {}   # Python dictionary with all the names of the films: key = movieID, value = movie title
-        for name in movie_names:
-            names_table[name[0]] = name[2] # the first element is the ID, the third elemnt is the title
-    # Now we have all the associations between ID and title, we miss the movie description
-    with open(filename, 'r') as csv_file:
-        descriptions = csv.reader(csv_file, delimiter = '\t')
-        corpus = []   # list of objects of type MovieDescription
-        for desc in descriptions:
-            try:      # at least in this dataset there are some errors so some descriptions have not a matching ID
-                movie = MovieDescription(names_table[desc[0]], desc[1]) # the first element is the ID, the second the description
-                corpus.append(movie)
-            except KeyError:  # in case we don't find the title associated to that ID
-                # We ignore the descriptions for which we cannot find a title
-                pass
-        return corpus
+def is_compressed(filename: str) -> bool:
+    """ Returns True if the file is compressed with gzip.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'  # the magic number of gzip
+
+def open_text(filename: str):
+    """ Opens a file for reading in binary mode, decompressing it if it is compressed with gzip.
+    """
+    return gzip.open(filename, 'rb') if is_compressed(filename) else open(filename, 'rb')
+
+def read_records(filename: str):
+    """ Generator of the records of a file of tab-separated values (plain text or compressed with gzip), one at a time.
+    It yields the pairs (offset, record), where offset is the position in the (uncompressed) file where the record starts.
+    """
+    with open_text(filename) as f:
+        records = csv.reader((line.decode('utf-8') for line in f), delimiter = '\t')  # the reader takes only the lines of the next record
+        while True:
+            offset = f.tell()
+            record = next(records, None)
+            if record is None:
+                return
+            yield offset, record
+
+class Corpus:
+    """ The documents of the corpus, whose descriptions are read from the file only when they are needed.
+    """
+
+    _filename: str
+    _titles: List[str]
+    _offsets: array
+    _added: List[MovieDescription]
+    _temporary: bool
+
+    def __init__(self, filename: str, titles: List[str], offsets: array, temporary: bool = False):
+        """ Class constructor.
+        Fields:
+          _filename  -- the file with the descriptions, in plain text
+          _titles    -- the title of each document
+          _offsets   -- the position in the file of the description of each document; the documents added
+                        later are kept in memory, and the offset of _added[k] is -1-k
+          _added     -- the documents added with `extend`
+          _file      -- the file, opened the first time a description is read
+          _temporary -- True if the file is a temporary copy (the decompressed corpus), deleted by `close`
+        """
+        self._filename = filename
+        self._titles = titles
+        self._offsets = offsets
+        self._added = []
+        self._file = None
+        self._temporary = temporary
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):  # the documents are not read, the slice shares the file
+            corpus = Corpus(self._filename, self._titles[key], self._offsets[key])
+            corpus._added = self._added
+            return corpus
+        offset = self._offsets[key]
+        if offset < 0:
+            return self._added[-1 - offset]
+        if self._file is None:
+            self._file = open(self._filename, 'rb')
+        self._file.seek(offset)
+        record = next(csv.reader((line.decode('utf-8') for line in self._file), delimiter = '\t'))
+        return MovieDescription(self._titles[key], record[1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self._titles)
+
+    def extend(self, documents: List[MovieDescription]):
+        """ Adds the documents at the end of the corpus.
+        """
+        for document in documents:
+            self._titles.append(document.title)
+            self._offsets.append(-1 - len(self._added))
+            self._added.append(document)
+
+    def close(self):
+        """ Closes the file of the descriptions, and deletes it if it is a temporary copy.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._temporary:
+            os.remove(self._filename)
+            self._temporary = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None  # the file is opened again after unpickling (e.g. by the processes building the index)
+        state['_temporary'] = False  # only the original corpus deletes the temporary file
+        return state
+
+def read_movie_descriptions(filename: str = 'data/plot_summaries.txt', movie_names_file: str = 'data/movie.metadata.tsv') -> Corpus:
+    names_table = {}   # Python dictionary with all the names of the films: key = movieID, value = movie title
+    for _, name in read_records(movie_names_file):
+        names_table[name[0]] = name[2] # the first element is the ID, the third elemnt is the title
+    # Now we have all the associations between ID and title, we only need the position of each description
+    temporary = is_compressed(filename)
+    if temporary:  # the descriptions are read in any order, so we decompress the file only once
+        with gzip.open(filename, 'rb') as f_in, tempfile.NamedTemporaryFile('wb', suffix='.txt', delete=False) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        filename = f_out.name
+    titles = []
+    offsets = array('q')
+    for offset, desc in read_records(filename):
+        title = names_table.get(desc[0])  # the first element is the ID, the second the description
+        if title is not None:  # at least in this dataset there are some errors so some descriptions have not a matching ID
+            titles.append(title)
+            offsets.append(offset)
+    return Corpus(filename, titles, offsets, temporary)
 
 """## Edit distance
 
-By computing the **<font color=#00ADEF>edit distance</font>** we can find the set of words that are the closest to a misspelled word. However, computing the edit distance on the entire dictionary can be too expensive. We can use some heuristics to limit the number of words, like looking only at words with the same initial letter (hopefully this has not been misspelled). The latter is what is implemented in this model.
+By computing the **<font color=#00ADEF>edit distance</font>** we can find the set of words that are the closest to a misspelled word. However, computing the edit distance on the entire dictionary can be too expensive. We can use some heuristics to limit the number of words, like looking only at words with the same initial letter (hopefully this has not been misspelled), as `find_nearest` does with `keep_first`.
+
+Instead, the index keeps its words in a `Vocabulary` (see below), whose deletion index finds the nearest word in the whole dictionary computing the edit distance only with a few candidates.
+
+The edit distance is computed with the bit-parallel algorithm of Myers (see `masked_edit_distance`), which uses the bits of an integer for a whole column of the dynamic programming matrix, and `find_nearest` stops computing the distance of a word as soon as it is greater than the one of the nearest word found until then.
 """
 
-def edit_distance(u, v, print = False):
-    """ Computes the edit (or Levenshtein) distance between two words u and v.
-    """
-    nrows = len(u) + 1
-    ncols = len(v) + 1
-    M = [[0] * ncols for i in range(0, nrows)]  # matrix all filled with zeros
-    for i in range(0, nrows):  # we fill the first row, the trivial one
-        M[i][0] = i
-    for j in range(0, ncols):  # we fill the first col, the trivial one
-        M[0][j] = j
-    for i in range(1, nrows):
-        for j in range(1, ncols):
-            candidates = [M[i-1][j] + 1, M[i][j-1] + 1]
-            if (u[i-1] == v[j-1]):
-                candidates.append(M[i-1][j-1])
-            else:
-                candidates.append(M[i-1][j-1] + 1)
-            M[i][j] = min(candidates)
-            # To print the distance matrix
-            if print:
-                print(M[i][j], end="\t")
-        if print:
-          print()
-    return M[-1][-1]  # Bottom right element of M (-1 means the last element)
+def pattern_masks(word: str) -> dict:
+    """ For each character of the word, the bitmask of its positions in the word (the bit i is set if word[i] is the character).
+    """
+    masks = {}
+    for i, c in enumerate(word):
+        masks[c] = masks.get(c, 0) | 1 << i
+    return masks
+
+def masked_edit_distance(masks: dict, m: int, v: str, max_distance = float('inf')) -> int:
+    """ Computes the edit distance between a word of length m, given by its `pattern_masks`, and the word v, with the
+    bit-parallel algorithm of Myers (in the version of Hyyrö): the column j of the dynamic programming matrix is
+    represented by the bitmasks of its vertical differences (+1 in `pv`, -1 in `mv`), and it is computed from the
+    column j-1 with a few operations on integers, so the cost is O(len(v)) instead of O(m*len(v)).
+    If the distance is greater than `max_distance` it stops as soon as it knows it, and it returns max_distance+1.
+    """
+    if abs(m - len(v)) > max_distance:   # the distance is at least the difference of the lengths
+        return max_distance + 1
+    if m == 0:
+        return len(v)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = full   # the first column is 0, 1, 2, ..., m
+    mv = 0
+    score = m   # the last element of the column
+    remaining = len(v)
+    for c in v:
+        eq = masks.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        remaining -= 1
+        if score - remaining > max_distance:   # each of the remaining characters can decrease the distance by at most 1
+            return max_distance + 1
+        ph = ph << 1 | 1    # the first row is 0, 1, 2, ..., len(v)
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+    return score
+
+def edit_distance(u: str, v: str, max_distance = float('inf')) -> int:
+    """ Computes the edit (or Levenshtein) distance between two words u and v. If it is greater than `max_distance`
+    it returns max_distance+1 (see `masked_edit_distance`).
+    """
+    return masked_edit_distance(pattern_masks(u), len(u), v, max_distance)
+
+def edit_distances(word: str, words: List[str], max_distance = float('inf')) -> List[int]:
+    """ Computes the edit distances between the word and all the given words, computing the `pattern_masks` only once.
+    """
+    masks = pattern_masks(word)
+    return [masked_edit_distance(masks, len(word), w, max_distance) for w in words]
 
 def find_nearest(word, dictionary, keep_first=False):
     if keep_first:
         # If keep_first is true then we only search across the words in the dictionary starting with the same letter
         dictionary = [w for w in dictionary if w[0] == word[0]]
-    # Remove comment to see the reduction in the size of the dictionary when keeping fixed the first letter
-    #print(len(dictionary))
-    # Apply f(x) = edit_distance(word, x) to all words in the dictionary
-    distances = map(lambda x: edit_distance(word, x), dictionary)
-    # Produce all the pairs (distance, term) usng zip and find one with the minimal distance.
-    return min(zip(distances, dictionary))[1]
+    # We keep the nearest word found until now, and we stop computing the distance of a word as soon as it is
+    # greater than the one of the nearest word (if more words have the same distance we take the first one in alphabetical order)
+    masks = pattern_masks(word)
+    nearest = (float('inf'), None)
+    for w in dictionary:
+        d = masked_edit_distance(masks, len(word), w, nearest[0])
+        if (d, w) < nearest:
+            nearest = (d, w)
+    return nearest[1]
+
+def deletions(word: str, max_deletes: int) -> set:
+    """ Returns the strings obtained by deleting at most `max_deletes` characters of the word (the word itself included).
+    """
+    strings = {word}
+    last = {word}
+    for _ in range(max_deletes):
+        last = {w[:i] + w[i+1:] for w in last for i in range(len(w))}
+        strings |= last
+    return strings
+
+def deletion_key(string: str) -> int:
+    """ The key of a string in the deletion index of a `Vocabulary`: 31 bits of its CRC-32 (unlike `hash`, it is the
+    same in every process, so it can be saved in the index file).
+    """
+    return zlib.crc32(string.encode('utf-8')) & 0x7fffffff
+
+"""### Vocabulary
+
+The spelling correction needs only the words of the index, and not their posting lists. The `Vocabulary` of the index keeps them in alphabetical order and grouped by length, together with a **<font color=#00ADEF>deletion index</font>** (as in SymSpell). It is built with the index and it is saved with it, so it is ready when a word has to be corrected.
+
+If two words are at edit distance d, we can delete at most d characters from each of them to obtain the same string (a substitution is a deletion from both words). So the deletion index maps every string obtained by deleting at most `max_deletes` characters from a word to the word: the words at distance at most `max_deletes` from a misspelled word are among the ones sharing a deletion with it, and we compute the edit distance only with them. The strings are not kept: the deletion index is a sorted array of their keys (see `deletion_key`) with the indexes of their words, so looking up a string is a binary search, and the time to correct a word grows only with the logarithm of the number of words.
+
+A word farther than `max_deletes` from all the words of the vocabulary is corrected by `scan_nearest`. Two words whose lengths differ by d are at edit distance at least d, so it looks for the nearest word first among the words with the same length, then among the ones whose length differs by 1, and so on, and it stops when the difference of the lengths is greater than the distance of the nearest word found until then. It corrects all the words of a query in a single pass over the length groups.
+"""
+
+class Vocabulary:
+
+    max_deletes = 1  # with 2 the deletion index would be about 4 times larger, and 5 times slower to build
+
+    words: List[str]
+    _length_order: array
+    _length_offsets: array
+    _deletes: array
+
+    def __init__(self, words: List[str], length_order: array, length_offsets: array, deletes: array):
+        """ Class constructor.
+        Fields:
+          words           -- the words in alphabetical order (a list, or a sequence that reads them from the index file)
+          _length_order   -- the indexes of the words sorted by length (and then alphabetically)
+          _length_offsets -- _length_offsets[n] is the index in `_length_order` of the first word with length n
+          _deletes        -- the deletion index: `deletion_key(d) << 32 | i` for each word i and for each of its `deletions` d, sorted
+        """
+        self.words = words
+        self._length_order = length_order
+        self._length_offsets = length_offsets
+        self._deletes = deletes
+
+    @classmethod
+    def from_words(cls, words: List[str]) -> 'Vocabulary':
+        """ Class constructor given the words in alphabetical order.
+        """
+        length_order = array('i', sorted(range(len(words)), key=lambda i: len(words[i])))  # the sort is stable, so the words with the same length remain in alphabetical order
+        lengths = [len(words[i]) for i in length_order]
+        length_offsets = array('i', [bisect_left(lengths, n) for n in range((lengths[-1] if lengths else 0) + 2)])
+        deletes = array('q', sorted(deletion_key(d) << 32 | i for i, w in enumerate(words) for d in deletions(w, cls.max_deletes)))
+        return cls(words, length_order, length_offsets, deletes)
+
+    def of_length(self, n: int) -> List[str]:
+        if n < 0 or n + 1 >= len(self._length_offsets):
+            return []
+        return [self.words[i] for i in self._length_order[self._length_offsets[n]:self._length_offsets[n+1]]]
+
+    def candidates(self, word: str) -> set:
+        """ Returns the indexes of the words sharing a deletion with the given word: all the words at edit distance at most
+        `max_deletes` from it are among them (with some farther words, and the ones whose keys collide).
+        """
+        found = set()
+        for d in deletions(word, self.max_deletes):
+            key = deletion_key(d) << 32
+            lo = bisect_left(self._deletes, key)
+            hi = bisect_left(self._deletes, key + (1 << 32), lo)
+            found.update(self._deletes[j] & 0xffffffff for j in range(lo, hi))
+        return found
+
+    def nearest_words(self, words: List[str], accept = None) -> List[tuple]:
+        """ Returns the nearest word of the vocabulary to each of the given words, with its distance, as a pair (distance,
+        word) (the first word in alphabetical order, if more words have the same distance), like `find_nearest` on all the words.
+        The words are looked up in the deletion index, and the ones that are not found are corrected with `scan_nearest`.
+        Arguments:
+          accept -- if given, only the words of the vocabulary for which it returns True can be the nearest ones
+        """
+        nearest = []
+        for w in words:
+            masks = pattern_masks(w)
+            best = (float('inf'), None)
+            for i in self.candidates(w):
+                v = self.words[i]
+                d = masked_edit_distance(masks, len(w), v, best[0])
+                if (d, v) < best and (accept is None or accept(v)):
+                    best = (d, v)
+            nearest.append(best)
+        far = [k for k, (d, _) in enumerate(nearest) if d > self.max_deletes]  # the nearest word could be any word
+        for k, found in zip(far, self.scan_nearest([words[k] for k in far], accept)):
+            nearest[k] = found
+        return nearest
+
+    def scan_nearest(self, words: List[str], accept = None) -> List[tuple]:
+        """ Like `nearest_words`, but computing the distances with the words of the vocabulary grouped by length.
+        """
+        masks = [pattern_masks(w) for w in words]
+        nearest = [(float('inf'), None)] * len(words)
+        max_length = len(self._length_offsets) - 2
+        for delta in range(max_length + max(map(len, words), default=0) + 1):
+            lengths = {len(w) + sign * delta for w in words for sign in (-1, 1)}
+            active = [k for k, w in enumerate(words) if delta <= nearest[k][0]]
+            if not active:  # all the other words are farther than the nearest ones we found
+                break
+            for n in sorted(lengths):
+                candidates = [k for k in active if abs(len(words[k]) - n) == delta]
+                if not candidates:
+                    continue
+                for v in self.of_length(n):
+                    for k in candidates:
+                        d = masked_edit_distance(masks[k], len(words[k]), v, nearest[k][0])
+                        if (d, v) < nearest[k] and (accept is None or accept(v)):
+                            nearest[k] = (d, v)
+        return nearest
+
+"""## Query cache
+
+Many queries are repeated, so the `IRsystem` keeps the results of the last queries in a cache with a bounded size. When the cache is full we evict the **least recently used** (LRU) result: an `OrderedDict` keeps the keys in the order in which they have been used, so the least recently used one is the first. The cache counts the hits and the misses, and it must be emptied with `clear` when the index changes.
+"""
+
+class LRUCache:
+
+    _entries: OrderedDict
+    capacity: int
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 1024):
+        """ Class constructor.
+        Fields:
+          _entries -- the cached values, from the least to the most recently used
+          capacity -- maximum number of cached values
+          hits     -- number of times a value has been found in the cache
+          misses   -- number of times a value has not been found in the cache
+        """
+        self._entries = OrderedDict()
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Returns the value cached for the key, or None if it is not in the cache.
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)  # now it is the most recently used
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)  # evict the least recently used value
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"{len(self)}/{self.capacity} cached results, {self.hits} hits, {self.misses} misses"
 
 """## IR System
 
-An `IRsystem` object contains the entire corpus and the `Index`. It has also various methods to answer to the queries.
+An `IRsystem` object contains the entire corpus and the `Index`. It has also various methods to answer to the queries, whose results are kept in a `LRUCache` (the key of a result is the normalized query, with the kind of query and its flags). The boolean queries cache also the results of their sub-expressions, so for example `(darth OR love)` is computed only once in different queries. When the index changes the cache has to be emptied with `invalidate_cache`.
 """
 
 class IRsystem:
 
     _corpus: list
     _index: Index
+    _cache: LRUCache
     
-    def __init__(self, corpus: list, index: 'Index'):
+    def __init__(self, corpus: list, index: 'Index', cache_size: int = 1024):
         self._corpus = corpus
         self._index = index
+        self._cache = LRUCache(cache_size)  # results of the last queries
         
     @classmethod
     def from_corpus(cls, corpus: list): # generates the entire index calling the constructor
@@ -505,32 +1775,69 @@ class IRsystem:
     def get_from_corpus(self, plist):
         return plist.get_from_corpus(self._corpus)
 
+    def add_documents(self, documents: List['MovieDescription']) -> List[int]:
+        """ Adds the documents to the corpus and to the index, and returns their docIDs.
+        """
+        first_docID = len(self._corpus)
+        self._corpus.extend(documents)
+        self._index.add_documents(documents, first_docID)
+        self.invalidate_cache()
+        return list(range(first_docID, len(self._corpus)))
+
+    def delete_documents(self, docIDs: List[int]):
+        """ Deletes the documents from the index: they will not be returned by the queries anymore (they remain in
+        the corpus, so that the docIDs of the other documents don't change).
+        """
+        self._index.delete_documents(docIDs)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """ Empties the cache of the queries. It must be called every time the index changes.
+        """
+        self._cache.clear()
+
+    def cache_info(self) -> LRUCache:
+        """ Returns the cache, whose representation shows its size and its number of hits and misses.
+        """
+        return self._cache
+
+    def correct_word(self, w: str) -> str:
+        ''' Returns the normalized word if it is in the index, otherwise the nearest word to it.
+        '''
+        return self.correct_words([w])[0]
+
+    def correct_words(self, words: List[str]) -> List[str]:
+        ''' Returns the normalized words, replacing the ones that are not in the index with the nearest words to them.
+        The unknown words are looked up in the deletion index of the vocabulary (see `Vocabulary.nearest_words`).
+        '''
+        unknown = [w for w in dict.fromkeys(words) if w not in self._index]
+        corrections = dict(zip(unknown, self._index.nearest_words(unknown)))
+        for w in words:
+            if w in corrections:
+                print("{} not found. Did you mean {}?".format(w, corrections[w]))
+        return [corrections.get(w, w) for w in words]
+
     def spelling_correction(self, norm_words: List[str]):
         ''' Performs a spelling correction of the normalized words finding the nearest words to the given ones.
         '''
-        postings = []
-        for w in norm_words:
-            try:
-                res = self._index[w]
-            except KeyError:
-                dictionary = [t.term for t in self._index._dictionary if "$" not in t.term] # the if is to remove the terms with inside the "end of word" $
-                sub = find_nearest(w, dictionary, keep_first=True)
-                print("{} not found. Did you mean {}?".format(w, sub))
-                res = self._index[sub]
-            postings.append(res)
-        return postings
+        return [self._index[w] for w in self.correct_words(norm_words)]
 
     def answer_and_query(self, words: List[str], spellingCorrection = False):
         """ AND-query
         Arguments:
           spellingCorrection -- if `True` a spelling correction is performed
         """
-        norm_words = map(normalize, words)  # Normalize all the words. IMPORTANT!!! If the user uses upper-case we will not have ANY match! We have to perform the same normalization of the docs in the corpus on the query!
-        if not spellingCorrection:
-            postings = map(lambda w: self._index[w], norm_words) # get the posting list for each word → list of posting lists
-        else:
-            postings = self.spelling_correction(norm_words)
-        plist = reduce(lambda x, y: x.intersection(y), postings)  # apply the function to the two items of the list, then apply it to the result with the third, then the result with the fourt term and so on until the end of the list
+        norm_words = list(map(normalize, words))  # Normalize all the words. IMPORTANT!!! If the user uses upper-case we will not have ANY match! We have to perform the same normalization of the docs in the corpus on the query!
+        key = ('AND', tuple(norm_words), spellingCorrection)
+        plist = self._cache.get(key)
+        if plist is None:
+            if not spellingCorrection:
+                postings = map(lambda w: self._index[w], norm_words) # get the posting list for each word → list of posting lists
+            else:
+                postings = self.spelling_correction(norm_words)
+            postings = map(lambda p: p.without_positions(), postings)  # we only need the docIDs
+            plist = intersect_all(list(postings))  # intersect the posting lists starting from the shortest ones
+            self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
     def answer_or_query(self, words: List[str], spellingCorrection = False):
@@ -538,12 +1845,17 @@ class IRsystem:
         Arguments:
           spellingCorrection -- if `True` a spelling correction is performed
         """
-        norm_words = map(normalize, words)
-        if not spellingCorrection:
-            postings = map(lambda w: self._index[w], norm_words)
-        else:
-            postings = self.spelling_correction(norm_words)
-        plist = reduce(lambda x, y: x.union(y), postings)
+        norm_words = list(map(normalize, words))
+        key = ('OR', tuple(norm_words), spellingCorrection)
+        plist = self._cache.get(key)
+        if plist is None:
+            if not spellingCorrection:
+                postings = map(lambda w: self._index[w], norm_words)
+            else:
+                postings = self.spelling_correction(norm_words)
+            postings = map(lambda p: p.without_positions(), postings)
+            plist = reduce(lambda x, y: x.union(y), postings)
+            self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
     def answer_not_query(self, words: List[str], spellingCorrection = False):
@@ -551,120 +1863,148 @@ class IRsystem:
         Arguments:
           spellingCorrection -- if `True` a spelling correction is performed
         """
-        norm_words = map(normalize, words)
-        if not spellingCorrection:
-            postings = map(lambda w: self._index[w], norm_words)
-        else:
-            postings = self.spelling_correction(norm_words)
-        words_plist = reduce(lambda x, y: x.union(y), postings)
-        plist = copy.deepcopy(self._index.complete_plist)
-        for i in words_plist:
-            if i in plist:
-                plist._postings.remove(i)
+        norm_words = list(map(normalize, words))
+        key = ('NOT', tuple(norm_words), spellingCorrection)
+        plist = self._cache.get(key)
+        if plist is None:
+            if not spellingCorrection:
+                postings = map(lambda w: self._index[w], norm_words)
+            else:
+                postings = self.spelling_correction(norm_words)
+            postings = map(lambda p: p.without_positions(), postings)
+            words_plist = reduce(lambda x, y: x.union(y), postings)
+            plist = self._index.complete_plist.without_positions().difference(words_plist)
+            self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
-    def answer_query(self, op: str, words = None, word = None, postings = None, postings2 = None, NOT_switch = False, spellingCorrection = False):
-        ''' Complex query.
+    def answer_boolean_query(self, text: str, spellingCorrection = False) -> PostingList:
+        """ Query with 'AND', 'OR', 'NOT' and parentheses, answered with the boolean query engine
+        (parsing with `parse_query`, planning with `plan_query` and evaluation with `evaluate_query`).
         Arguments:
-          NOT_switch -- Used to switch the order of the two posting lists `postings` and `postings2` in the NOT query, since this operator is not commutative.
           spellingCorrection -- if `True` a spelling correction is performed
-        '''
-        if words:
-            norm_word_0 = normalize(words[0])
-            norm_word_1 = normalize(words[1])
-            if not spellingCorrection:
-                postings = self._index[norm_word_0]
-                postings2 = self._index[norm_word_1]
-            else:
-                postings = self.spelling_correction([norm_word_0])[0]
-                postings2 = self.spelling_correction([norm_word_1])[0]
-        elif word:
-            norm_word = normalize(word)
-            if not spellingCorrection:
-                postings2 = self._index[norm_word]
-            else:
-                postings2 = self.spelling_correction([norm_word])[0]
-
-        if op == 'AND':
-            plist = postings.intersection(postings2)
-            return plist
-        elif op == 'OR':
-            plist = postings.union(postings2)
+        """
+        tokens = tuple(t if t in ['AND', 'OR', 'NOT', '(', ')'] else normalize(t) for t in split_query(text))
+        key = ('BOOLEAN', tokens, spellingCorrection)  # the normalized query: on a hit it is not even parsed
+        plist = self._cache.get(key)
+        if plist is not None:
             return plist
-        elif op == 'NOT':
-            if not NOT_switch: # used to control the order of postings and postings2
-                postings_copy = copy.deepcopy(postings)
-                for i in postings2:
-                    if i in postings_copy:
-                        postings_copy._postings.remove(i)
-                return postings_copy
-            else:
-                postings2_copy = copy.deepcopy(postings2)
-                for i in postings:
-                    if i in postings2_copy:
-                        postings2_copy._postings.remove(i)
-                return postings2_copy
+        tree = parse_query(text)
+        if spellingCorrection:
+            words = tree.words()
+            tree.replace_words(dict(zip(words, self.correct_words(words))))
+        postings = {w: self._index[w].without_positions() for w in tree.words()}  # we only need the docIDs
+        tree = plan_query(tree, postings, len(self._index.complete_plist))
+        plist = self.evaluate_query(tree, postings)
+        if isinstance(plist, NegatedPostingList):
+            plist = plist.materialize()
+        self._cache.put(key, plist)
+        return plist
+
+    def evaluate_query(self, node: 'QueryNode', postings: dict):
+        """ Evaluates the (planned) tree of a boolean query. Returns a PostingList or a NegatedPostingList.
+        Arguments:
+          postings -- dictionary with the PostingList of each word of the query
+        """
+        if node.op == 'WORD':
+            return postings[node.word]
+        if node.op == 'NOT':
+            return negate(self.evaluate_query(node.children[0], postings), self._index.complete_plist.without_positions())
+        key = ('EXPR', repr(node))  # the results of the sub-expressions are cached too, to be reused by other queries
+        plist = self._cache.get(key)
+        if plist is None:
+            plist = self._evaluate_operator(node, postings)
+            self._cache.put(key, plist)
+        return plist
+
+    def _evaluate_operator(self, node: 'QueryNode', postings: dict):
+        """ Evaluates an 'AND' or an 'OR' node of the tree of a boolean query.
+        """
+        if node.op == 'OR':
+            return reduce(lambda x, y: x.union(y), (self.evaluate_query(child, postings) for child in node.children))
+        # AND: we intersect the operands from the smallest one, then we remove the negated ones
+        positive = [child for child in node.children if child.op != 'NOT']
+        negative = [child.children[0] for child in node.children if child.op == 'NOT']
+        if not positive:  # NOT x AND NOT y = NOT (x OR y)
+            plist = reduce(lambda x, y: x.union(y), (self.evaluate_query(child, postings) for child in negative))
+            return negate(plist, self._index.complete_plist.without_positions())
+        plist = self.evaluate_query(positive[0], postings)
+        for child in positive[1:]:
+            if not plist:  # the intersection with an empty posting list is empty, no need to evaluate the other operands
+                return plist
+            plist = plist.intersection(self.evaluate_query(child, postings))
+        for child in negative:
+            if not plist:
+                return plist
+            plist = plist.difference(self.evaluate_query(child, postings))
+        return plist
 
     def answer_phrase_query(self, words: List[str], spellingCorrection = False):
         """ Phrase-query
         Arguments:
           spellingCorrection -- if `True` a spelling correction is performed
         """
-        norm_words = map(normalize, words)  # Normalize all the words. IMPORTANT!!! If the user uses upper-case we will not have ANY match! We have to perform the same normalization of the docs in the corpus on the query!
-        if not spellingCorrection:
-            postings = map(lambda w: self._index[w], norm_words) # get the posting list for each word → list of posting lists
-        else:
-            postings = self.spelling_correction(norm_words)
-        # Reduce
-        it = enumerate(iter(postings))
-        i, plist = next(it)
-        for i, element in it:
-            # i is the step 
-            plist = plist.positional_search(element, i)
+        norm_words = list(map(normalize, words))  # Normalize all the words. IMPORTANT!!! If the user uses upper-case we will not have ANY match! We have to perform the same normalization of the docs in the corpus on the query!
+        key = ('PHRASE', tuple(norm_words), spellingCorrection)
+        plist = self._cache.get(key)
+        if plist is None:
+            if spellingCorrection:
+                norm_words = self.correct_words(norm_words)
+            plist = self._index.phrase(norm_words)
+            self._cache.put(key, plist)
         return plist, self.get_from_corpus(plist)
 
-    def answer_phrase_query_ksteps(self, term1: str, term2: str, k: int, spellingCorrection = False):
+    def answer_phrase_query_ksteps(self, term1: str, term2: str, k: int, spellingCorrection = False, ordered = True):
         """ Phrase-query of the form 'term1 /k term2'
         Arguments:
           spellingCorrection -- if `True` a spelling correction is performed
+          ordered            -- if `False` term2 can also come before term1
         """
         norm_term1 = normalize(term1)
         norm_term2 = normalize(term2)
+        key = ('KSTEPS', norm_term1, norm_term2, k, spellingCorrection, ordered)
+        plist = self._cache.get(key)
+        if plist is not None:
+            return plist, self.get_from_corpus(plist)
         if not spellingCorrection:
             postings1 = self._index[norm_term1]
             postings2 = self._index[norm_term2]
         else:
-            postings1 = self.spelling_correction(norm_term1)
-            postings2 = self.spelling_correction(norm_term2)
-        plist = []
-        for i in range(1, k+2): # k+1 because I have to count also the last word, and +1 again because otherwise 'range' is [1,k+1) and I need [1, k+1]
-            plist.append(postings1.positional_search(postings2, i))
-        plist = reduce(lambda x, y: x.union(y), plist)
+            postings1, postings2 = self.spelling_correction([norm_term1, norm_term2])
+        plist = postings1.proximity_search(postings2, k, ordered)
+        self._cache.put(key, plist)
         return plist, self.get_from_corpus(plist)
 
     def answer_trailing_wildcard(self, wildcard):
         """ Trailing wildcard query
         """
-        plist = []
-        for w in self._index._dictionary:
-            if starts_with(w.term, wildcard):
-                plist.append(w.posting_list)
-        plist = reduce(lambda x, y: x.union(y), plist)
+        key = ('TRAILING', wildcard)
+        plist = self._cache.get(key)
+        if plist is not None:
+            return self.get_from_corpus(plist)
+        terms = {w for idx in self._index._generations() for r, w in idx.rotations(idx.prefix_range(wildcard))}  # the rotations "word$" are the words
+        plist = union_all([self._index[t].without_positions() for t in sorted(terms)])  # the answer only needs the docIDs
+        self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
     def answer_leading_wildcard(self, wildcard):
         """ Leading wildcard query
         """
-        plist = []
-        for w in self._index._reverse_dictionary:
-            if ends_with(w.term, wildcard):
-                plist.append(w.posting_list)
-        plist = reduce(lambda x, y: x.union(y), plist)
+        key = ('LEADING', wildcard)
+        plist = self._cache.get(key)
+        if plist is not None:
+            return self.get_from_corpus(plist)
+        terms = {idx._reverse_dictionary[i].term for idx in self._index._generations() for i in idx.suffix_range(wildcard)}
+        plist = union_all([self._index[t].without_positions() for t in sorted(terms, key=backwards)])
+        self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
     def answer_multiple_wildcards(self, text):
         """ Multiple wildcard query
         """
+        key = ('MULTIPLE', text)
+        plist = self._cache.get(key)
+        if plist is not None:
+            return self.get_from_corpus(plist)
         text += "$"
         # Fold inside a single wildcard
         i1 = text.index("*")        # the first *
@@ -675,20 +2015,103 @@ class IRsystem:
         i = folded.index("*")
         wildcard = folded[i+1:] + folded[:i]
         # Collect all the terms matching the simplified query
-        terms_list = []
-        for w in self._index._dictionary:
-            if starts_with(w.term, wildcard):
-                terms_list.append(w)
+        terms_list = sorted((r, w) for idx in self._index._generations() for r, w in idx.rotations(idx.prefix_range(wildcard)))
         # Filtering step
         plist = []
         unfolded = wildcard + text[i1:i3+1]
         query = unfolded.replace("*", "\S*").replace("$", "\$")
-        for t in terms_list:
-            if re.search(query, t.term):
-                plist.append(t.posting_list)
-        plist = reduce(lambda x, y: x.union(y), plist)
+        for r, w in terms_list:
+            if re.search(query, r):
+                plist.append(self._index[w].without_positions())
+        plist = union_all(plist)
+        self._cache.put(key, plist)
         return self.get_from_corpus(plist)
 
+def intersect_all(postings: List[PostingList]) -> PostingList:
+    """ Intersects all the given posting lists. The cost of an intersection depends on the length of the lists,
+    so we start from the shortest ones (the ones of the rarest words) to keep the intermediate results small,
+    and we stop as soon as the result is empty.
+    """
+    postings = sorted(postings, key=len)
+    plist = postings[0]
+    for other in postings[1:]:
+        if not plist:  # the intersection with an empty posting list is empty
+            break
+        plist = plist.intersection(other)
+    return plist
+
+def union_all(postings: List[PostingList]) -> PostingList:
+    """ Unifies all the given posting lists in a single pass, with a k-way merge: a heap gives the smallest docID
+    among the first postings of all the lists (instead of unifying them two by two, which copies the partial
+    result again for every list). When a docID is in more lists we take the posting of the first one, like
+    `PostingList.union` does.
+    """
+    postings = [plist for plist in postings if plist]
+    if not postings:
+        return PostingList()
+    if len(postings) == 1:
+        return postings[0]
+    if any(plist._positions is None for plist in postings):   # without positions we only need the union of the docIDs
+        return PostingList.from_arrays(array('i', sorted(set().union(*(plist._docIDs for plist in postings)))))
+    streams = [zip(plist._docIDs, repeat(n), range(len(plist))) for n, plist in enumerate(postings)]  # the (docID, list, index) of each posting
+    docIDs = array('i')
+    positions = array('i')
+    offsets = array('i', [0])
+    for docID, group in groupby(heapq.merge(*streams), key=lambda posting: posting[0]):
+        _, n, k = next(group)   # the posting of the first list containing the docID
+        plist = postings[n]
+        docIDs.append(docID)
+        positions.extend(plist._positions[plist._offsets[k]:plist._offsets[k+1]])
+        offsets.append(len(positions))
+    return PostingList.from_arrays(docIDs, positions, offsets)
+
+def phrase_search(postings: List[PostingList], phrase_offsets: List[int] = None) -> PostingList:
+    """ Returns the posting list of the documents containing the words of the given posting lists one after
+    the other, with the positions where the phrase starts (like chaining `positional_search` from the first
+    word). If `phrase_offsets` is given, phrase_offsets[k] is the position in the phrase of postings[k] (by
+    default k), so the posting lists of the biwords can be used too. First we find the documents containing
+    all the words with `intersect_all` (which starts from the rarest word and uses galloping and bitmaps),
+    so the positions of the other documents are never read.
+    Then in each document the candidate starts of the phrase come from the positions of the rarest word,
+    and each other word, from the rarest to the most frequent, keeps the candidates c such that
+    c + (its offset in the phrase) is one of its positions, found with a binary search on its positions.
+    """
+    if phrase_offsets is None:
+        phrase_offsets = range(len(postings))
+    if len(postings) == 1 and phrase_offsets[0] == 0:
+        return postings[0]
+    order = sorted(range(len(postings)), key=lambda n: len(postings[n]))  # from the rarest word
+    common = intersect_all([plist.without_positions() for plist in postings])
+    first = postings[order[0]]
+    docs0, offsets0, positions0, k0 = first._docIDs, first._offsets, first._positions, phrase_offsets[order[0]]
+    others = [(phrase_offsets[n], postings[n]._docIDs, postings[n]._offsets, postings[n]._positions) for n in order[1:]]
+    cursors = [0] * len(others)   # the index of the current document in each posting list
+    i = 0
+    docIDs = array('i')
+    positions = array('i')
+    offsets = array('i', [0])
+    for docID in common._docIDs:
+        i = bisect_left(docs0, docID, i)
+        candidates = [p - k0 for p in positions0[offsets0[i]:offsets0[i+1]]]   # the starts of the phrase given by the rarest word
+        for n, (k, docs, offs, pos) in enumerate(others):
+            j = cursors[n] = bisect_left(docs, docID, cursors[n])
+            lo = offs[j];  end = offs[j+1]
+            matches = []
+            for c in candidates:   # the candidates are sorted, so we only move forward in the positions
+                lo = bisect_left(pos, c + k, lo, end)
+                if lo == end:
+                    break
+                if pos[lo] == c + k:
+                    matches.append(c)
+            candidates = matches
+            if not candidates:
+                break
+        if candidates:
+            docIDs.append(docID)
+            positions.extend(candidates)
+            offsets.append(len(positions))
+    return PostingList.from_arrays(docIDs, positions, offsets)
+
 def starts_with(word, prefix):
     """ Checks if the given word starts with the given prefix.
     """
@@ -707,6 +2130,178 @@ def ends_with(word, suffix):
     else:
         return False
 
+"""## Boolean query engine
+
+The queries with 'AND', 'OR', 'NOT' and parentheses are answered in three steps:
+1. **Parsing**: `parse_query` reads the query with a recursive descent parser and builds its *abstract syntax tree* (AST), made of `QueryNode`s. All the operators have the same precedence and they are evaluated from left to right, so "yoda OR darth AND Gandalf" means "(yoda OR darth) AND Gandalf", while a run of the same operator, like "yoda AND darth AND Gandalf", is a single node with all its operands. A 'NOT' at the place of an operand negates it ("yoda AND NOT darth"), while "x NOT y" is read as "x AND (NOT y)".
+2. **Planning**: `plan_query` rewrites the tree: nested ANDs and ORs are flattened into a single node, the double negations are removed and the operands of each AND are sorted from the one with the smallest (estimated) number of documents, with the negated operands at the end, so that they become differences.
+3. **Evaluation**: `IRsystem.answer_boolean_query` evaluates the planned tree on the index. The intersections of an AND stop as soon as the result is empty, and a NOT is a `NegatedPostingList`, so it is computed only if needed.
+
+Each token of the query is read only once, so the cost of parsing and planning is linear in the length of the query.
+"""
+
+class QuerySyntaxError(Exception):
+    pass
+
+class QueryNode:
+
+    op: str
+    word: str
+    children: list
+    size: int
+    _repr: str
+
+    def __init__(self):
+        """ Class constructor.
+        Fields:
+          op       -- 'WORD' for the leaves of the tree, otherwise the operator: 'AND', 'OR' or 'NOT'
+          word     -- the normalized word, for the 'WORD' nodes
+          children -- the operands of the operator (a 'NOT' node has only one child)
+          size     -- the estimated number of documents matching the node, computed by `plan_query`
+          _repr    -- the representation of the node, computed only once
+        """
+        self.op = None
+        self.word = None
+        self.children = []
+        self.size = None
+        self._repr = None
+
+    @classmethod
+    def given_word(cls, word: str) -> 'QueryNode':
+        node = cls()
+        node.op = 'WORD'
+        node.word = word
+        return node
+
+    @classmethod
+    def given_children(cls, op: str, children: list) -> 'QueryNode':
+        node = cls()
+        node.op = op
+        node.children = children
+        return node
+
+    def replace_words(self, replacements: dict):
+        """ Replaces (in place) the words of the query with the ones given in the dictionary.
+        """
+        if self.op == 'WORD':
+            self.word = replacements[self.word]
+        self._repr = None
+        for child in self.children:
+            child.replace_words(replacements)
+
+    def words(self) -> List[str]:
+        """ Returns the words of the query, in the order in which they are written.
+        """
+        if self.op == 'WORD':
+            return [self.word]
+        return [w for child in self.children for w in child.words()]
+
+    def __repr__(self):
+        if self._repr is None:
+            if self.op == 'WORD':
+                self._repr = self.word
+            elif self.op == 'NOT':
+                self._repr = "NOT " + repr(self.children[0])
+            else:
+                self._repr = "(" + (" " + self.op + " ").join(map(repr, self.children)) + ")"
+        return self._repr
+
+def split_query(text: str) -> List[str]:
+    """ Splits a query in its tokens: words, operators and parentheses.
+    """
+    # add a space around '(' and ')' so to split them into separate tokens
+    text = re.sub(r"\(", r' ( ', text)
+    text = re.sub(r"\)", r' ) ', text)
+    return text.split()
+
+def parse_query(text: str) -> QueryNode:
+    """ Returns the abstract syntax tree of the query. It implements the grammar
+      expression := operand (('AND' | 'OR' | 'NOT') operand)*
+      operand    := 'NOT' operand | '(' expression ')' | word
+    """
+    tokens = split_query(text)
+    node, i = parse_expression(tokens, 0)
+    if i < len(tokens):
+        raise QuerySyntaxError(f"Unexpected '{tokens[i]}' in the query: use 'AND', 'OR' or 'NOT' to connect the words.")
+    return node
+
+def parse_expression(tokens: List[str], i: int):
+    """ Parses the expression starting at the token i. Returns its tree and the index of the first token after it.
+    A run of the same operator gives a single node with all the operands ("x AND y AND z" has three children),
+    so the depth of the tree doesn't grow with the length of the query.
+    """
+    node, i = parse_operand(tokens, i)
+    run = None  # the node of the current run of the same operator
+    while i < len(tokens) and tokens[i] in ['AND', 'OR', 'NOT']:
+        op = tokens[i]
+        operand, i = parse_operand(tokens, i+1)
+        if op == 'NOT':  # x NOT y = x AND (NOT y)
+            op = 'AND'
+            operand = QueryNode.given_children('NOT', [operand])
+        if run is not None and run.op == op:
+            run.children.append(operand)
+        else:
+            node = run = QueryNode.given_children(op, [node, operand])  # left to right, so the tree grows on the left
+    return node, i
+
+def parse_operand(tokens: List[str], i: int):
+    """ Parses the operand starting at the token i. Returns its tree and the index of the first token after it.
+    """
+    if i == len(tokens):
+        raise QuerySyntaxError("The query cannot end with an operator.")
+    token = tokens[i]
+    if token == 'NOT':
+        operand, i = parse_operand(tokens, i+1)
+        return QueryNode.given_children('NOT', [operand]), i
+    if token == '(':
+        node, i = parse_expression(tokens, i+1)
+        if i == len(tokens) or tokens[i] != ')':
+            raise QuerySyntaxError("The number of right parentheses is different from the number of left parentheses.")
+        return node, i+1
+    if token in ['AND', 'OR', ')']:
+        raise QuerySyntaxError(f"Unexpected '{token}' in the query.")
+    return QueryNode.given_word(normalize(token)), i+1
+
+def plan_query(node: QueryNode, postings: dict, n_docs: int) -> QueryNode:
+    """ Rewrites the tree of a query to make its evaluation cheaper, setting the estimated size of each node.
+    Arguments:
+      postings -- dictionary with the PostingList of each word of the query
+      n_docs   -- number of documents of the corpus
+    """
+    if node.op == 'WORD':
+        node.size = len(postings[node.word])
+        return node
+    children = [plan_query(child, postings, n_docs) for child in node.children]
+    if node.op == 'NOT':
+        if children[0].op == 'NOT':  # NOT NOT x = x
+            return children[0].children[0]
+        node = QueryNode.given_children('NOT', children)
+        node.size = n_docs - children[0].size
+        return node
+    flat = []
+    for child in children:  # (x AND y) AND z = x AND y AND z, and the same for OR
+        if child.op == node.op:
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+    # The order of the operands is also made unique (ties are broken with their representation), so equal sub-expressions have the same representation
+    if node.op == 'AND':
+        positive = sorted((c for c in flat if c.op != 'NOT'), key=lambda c: (c.size, repr(c)))
+        negative = sorted((c for c in flat if c.op == 'NOT'), key=repr)
+        node = QueryNode.given_children('AND', positive + negative)  # the negated operands become differences at the end
+        node.size = min(c.size for c in flat)
+    else:
+        node = QueryNode.given_children('OR', sorted(flat, key=repr))
+        node.size = min(n_docs, sum(c.size for c in flat))
+    return node
+
+def negate(plist, complete_plist: PostingList):
+    """ Returns the NOT of a PostingList or of a NegatedPostingList.
+    """
+    if isinstance(plist, NegatedPostingList):
+        return plist._plist
+    return NegatedPostingList(plist, complete_plist)
+
 """## Queries"""
 
 def print_result(answer: PostingList, spellingCorrection=False):
@@ -755,7 +2350,7 @@ def not_query(ir: IRsystem, text: str, spellingCorrection=False, noprint=True):
 
 def query(ir: IRsystem, text: str, spellingCorrection=False, noprint=True):
     """ This function can answer complex queries with 'AND', 'OR' and 'NOT', but without parentheses.
-    E.g. text = "yoda AND darth OR Gandalf NOT love".
+    E.g. text = "yoda AND darth OR Gandalf NOT love". 'NOT' can also be put before a word, like in "yoda AND NOT darth".
     Arguments:
       spellingCorrection -- if `True` a spelling correction is performed
       noprint            -- if `True` the result of the query is not printed
@@ -764,12 +2359,11 @@ def query(ir: IRsystem, text: str, spellingCorrection=False, noprint=True):
     if len(words) == 1:
         print("You cannot use one single word! Use at least two words connected with a logical operator.")
         return None
-    for i, w in enumerate(words):
-        if w in ['AND', 'OR', 'NOT']:
-            if i == 1:
-                plist = ir.answer_query(op = w, words = [words[i-1], words[i+1]], spellingCorrection=spellingCorrection)
-            else:
-                plist = ir.answer_query(op = w, word = words[i+1], postings = plist, spellingCorrection=spellingCorrection)
+    try:
+        plist = ir.answer_boolean_query(text, spellingCorrection)
+    except QuerySyntaxError as e:
+        print(e)
+        return None
     answer = ir.get_from_corpus(plist)
     if not noprint:
         print_result(answer, spellingCorrection)
@@ -783,71 +2377,23 @@ def query_with_pars(ir: IRsystem, text: str, spellingCorrection=False, noprint=T
       spellingCorrection -- if `True` a spelling correction is performed
       noprint             -- if `True` the result of the query is not printed
     """
-    # add a space after '(' and before ')' so to split them into separate tokens
-    text = re.sub(r"\(", r'( ', text)
-    text = re.sub(r"\)", r' )', text)
-    # split the text in words (it eliminates spaces at the beginning/end of words, so even if we add them with the first passage it's not important)
-    words = text.split()
+    words = split_query(text)
 
     if len(words) == 1 or (len(words) == 3 and ("(" in words or ")" in words)):
         print("You cannot use one single word! Use at least two words connected with a logical operator.")
         return None
 
-    # words_mod = copy.deepcopy(words) # For now not necessary, I don't reuse the array 'words'
-    words_mod = words                  # I write it like this so it is easy to change if 'words' will be needed
-    # Wrap the text in two parentheses so to perform the following while one last time, avoiding to repeat code, and compute the whole query
-    words_mod.insert(0, "(")
-    words_mod.append(")")
-    
-    rightpar = []   # array of indexes with the positions of the right parentheses
-    leftpar  = []   # array of indexes with the positions of the left parentheses
-    for i, w in enumerate(words_mod):
-        if w == "(": rightpar.append(i)
-        elif w == ")": leftpar.append(i)
-    
-    if len(rightpar) != len(leftpar):
+    if words.count("(") != words.count(")"):
         print("The number of right parentheses is different from the number of left parentheses.")
         return None
 
-    while leftpar:
-        c = leftpar[0]
-        o = None
-        for i in rightpar:
-            if i < c:
-                o = i
-        #plist = PostingList()  # wrong, since if there are extra parentheses around all the query I overwrite the last plist and I store in words_mod an empty plist
-        # Process the query in these parentheses, the remove o in rightpar and c in leftpar
-        for i, w in enumerate(words_mod[o+1 : c]):
-            if w in ['AND', 'OR', 'NOT']:
-                if i == 1:
-                    item1 = words_mod[(o+1) + i-1]
-                    item2 = words_mod[(o+1) + i+1]
-                    # Checks to call `ir.answer_query` in the right way
-                    if type(item1) == str and type(item2) == str:
-                        plist = ir.answer_query(op = w, words = [item1, item2], spellingCorrection=spellingCorrection)
-                    elif type(item1) == PostingList and type(item2) == str:
-                        plist = ir.answer_query(op = w, word = item2, postings = item1, spellingCorrection=spellingCorrection)
-                    elif type(item1) == str and type(item2) == PostingList:
-                        plist = ir.answer_query(op = w, word = item1, postings = item2, NOT_switch = True, spellingCorrection = spellingCorrection)
-                    elif type(item1) == PostingList and type(item2) == PostingList:
-                        plist = ir.answer_query(op = w, postings = item1, postings2 = item2, spellingCorrection=spellingCorrection)
-                else:
-                    item2 = words_mod[(o+1) + i+1]
-                    if type(item2) == str:
-                        plist = ir.answer_query(op = w, word = item2, postings = plist, spellingCorrection=spellingCorrection)
-                    elif type(item2) == PostingList:
-                        plist = ir.answer_query(op = w, postings = plist, postings2 = item2, spellingCorrection=spellingCorrection)
-        words_mod[o] = plist
-        del words_mod[o+1:c+1]
-        rightpar = []
-        leftpar  = []
-        for i, w in enumerate(words_mod):
-            if w == "(": rightpar.append(i)
-            elif w == ")": leftpar.append(i)
-    
+    try:
+        plist = ir.answer_boolean_query(text, spellingCorrection)
+    except QuerySyntaxError as e:
+        print(e)
+        return None
     answer = ir.get_from_corpus(plist)
     if not noprint:
-
         print_result(answer, spellingCorrection)
     return answer
 
@@ -869,9 +2415,9 @@ def phrase_query(ir: IRsystem, text: str, spellingCorrection=False, noprint=True
         print_result(answer, spellingCorrection)
     return posting_list, answer
 
-def phrase_query_ksteps(ir: IRsystem, text: str, spellingCorrection=False, noprint=True):
+def phrase_query_ksteps(ir: IRsystem, text: str, spellingCorrection=False, noprint=True, ordered=True):
     ''' This function can answer a phrase query of the form 'term1 /k term2'  with k an integer
-    indicating the maximum number of words that can be between term1 and term2.
+    indicating the maximum number of words that can be between term1 and term2 (in any order if not `ordered`).
     '''
     words = text.split()
     if len(words) != 3:
@@ -880,7 +2426,7 @@ def phrase_query_ksteps(ir: IRsystem, text: str, spellingCorrection=False, nopri
         k = int(words[1][1:])
     else:
         print("ERROR: for now you can only use a query of the form: 'term1 /k term2' with k an integer.")
-    posting_list, answer = ir.answer_phrase_query_ksteps(words[0], words[2], k, spellingCorrection)
+    posting_list, answer = ir.answer_phrase_query_ksteps(words[0], words[2], k, spellingCorrection, ordered)
     if not noprint:
         print_result(answer, spellingCorrection)
     return posting_list, answer
@@ -893,7 +2439,7 @@ Ho anche una domanda per quanto riguarda l'implementazione. A lezione abbiamo vi
 
 In a **<font color=#00ADEF>trailing wildcard</font>** there is only one wildcard and it is at the end of the word, like **"term\*"**, in which we want everything starting with "term".
 
-To answer the query we can retrieve the posting lists of all the terms that starts with "term" and then perform a union of the results.
+To answer the query we can retrieve the posting lists of all the terms that starts with "term" and then perform a union of the results. The rotations of the permuterm index are sorted, so the ones starting with "term" are contiguous (like the subtree of "term" in a search tree): `Index.prefix_range` finds the first and the last one with two binary searches, and we don't scan the whole dictionary. The general wildcards and the multiple wildcards, which are rotated to become trailing wildcards, use the same range lookup.
 """
 
 def trailing_wildcard(ir: IRsystem, text: str, noprint=True):
@@ -906,7 +2452,7 @@ def trailing_wildcard(ir: IRsystem, text: str, noprint=True):
 
 """### Leading wildcard
 
-In a **<font color=#00ADEF>leading wildcard</font>** there is only one wildcard and it is at the beginning of the word, like **"*term"**, in which we want everything ending with "term". We can build an additional dictionary in the index which has in alphabetical order the reverse of the words. Then the "leading wildcard" is like an "inverse wildcard" for the reverse dictiornary.
+In a **<font color=#00ADEF>leading wildcard</font>** there is only one wildcard and it is at the beginning of the word, like **"*term"**, in which we want everything ending with "term". We can build an additional dictionary in the index which has in alphabetical order the reverse of the words. Then the "leading wildcard" is like an "inverse wildcard" for the reverse dictiornary: the words ending with "term" are contiguous in it, and `Index.suffix_range` finds them with two binary searches on the reversed words.
 """
 
 def leading_wildcard(ir: IRsystem, text: str, noprint=True):
@@ -960,36 +2506,43 @@ def multiple_wildcards(ir: IRsystem, text: str, noprint=True):
 corpus = read_movie_descriptions()
 len(corpus)
 
+"""The file of the descriptions can also be compressed with gzip (as it is downloaded): it is decompressed once in a temporary file, which is deleted when the corpus is closed. We check it with the first 1000 documents."""
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    compressed = os.path.join(tmpdir, "plot_summaries.txt.gz")
+    with open(corpus._filename, 'rb') as f_in, gzip.open(compressed, 'wb') as f_out:
+        f_out.write(f_in.read(corpus._offsets[1000]))  # the descriptions before the 1001st document
+    with read_movie_descriptions(compressed) as compressed_corpus:
+        assert [(d.title, d.description) for d in compressed_corpus] == [(d.title, d.description) for d in corpus[:1000]]
+        assert compressed_corpus[500].description == corpus[500].description
+    assert not os.path.exists(compressed_corpus._filename)
+
 """#### Saving / loading the index
 
-We will save the index using `Pickle`. `Pickle` is used for serializing and de-serializing Python object structures, also called marshalling or flattening. Serialization refers to the process of converting an object in memory to a byte stream that can be stored on disk or sent over a network. Later on, this character stream can then be retrieved and de-serialized back to a Python object.
+We will save the index in the binary format of `IndexFile`. Opening it with `Index.from_file` maps the file in memory without reading it: the terms and the posting lists are decoded only when a query uses them, so loading the index is almost instantaneous (instead of de-serializing the whole object structure, as `Pickle` does).
 """
 
 updated = True
 
-filename = "index.pickle"
+filename = "index.bin"
 
 # If the index is saved and it is updated I load it, otherwise I create it and save it
 if os.path.isfile(filename) and updated:
     print ("Index file exists. Loading the index...")
     # load the index
     tic = time.time()
-    infile = open(filename, 'rb')
-    idx = pickle.load(infile)
-    infile.close()
+    idx = Index.from_file(filename)
     toc = time.time()
     print("Index loaded.")
     print(f"Time: {round(toc-tic, 3)}s")
 else:
     print ("Index file does not exist.")
     tic = time.time()
-    idx = Index.from_corpus(corpus)
+    idx = Index.from_corpus(corpus, biword_threshold=100)  # the pairs of words found in at least 100 documents go in the biword index
     toc = time.time()
     print(f"\n\nTime: {round(toc-tic, 3)}s")
     # save the index
-    outfile = open(filename, 'wb')
-    pickle.dump(idx, outfile)
-    outfile.close()
+    idx.save(filename)
 
 print(idx)
 
@@ -1137,6 +2690,11 @@ yNdOg_set = yNd_set.union(gandalf_set)
 
 assert set(yNdOg_query) == yNdOg_set
 
+yNd_query = query(ir, "yoda AND NOT darth")
+
+assert set(yNd_query) == yNd_set
+assert set(query_with_pars(ir, "(yoda AND NOT darth)")) == yNd_set
+
 """#### Using parentheses"""
 
 query_with_pars(ir, "(yoda)", noprint=False)
@@ -1188,6 +2746,14 @@ hOphApaOypOiApaAfpOiAaApsOhpAcp_set = hello_set.union(hApaOypOiApaAfpOiAaApsOhpA
 
 assert set(hOphApaOypOiApaAfpOiAaApsOhpAcp_query) == hOphApaOypOiApaAfpOiAaApsOhpAcp_set
 
+"""A long query made of a single operator is a single node, so it doesn't hit the recursion limit of Python."""
+
+long_words = [ir._index._dictionary[i].term for i in range(1000)]
+long_or_query = query(ir, " OR ".join(long_words))
+assert set(long_or_query) == set(ir.get_from_corpus(union_all([ir._index[w] for w in long_words])))
+long_and_query = query_with_pars(ir, "(" + " AND ".join(["yoda"] * 500 + ["darth"] * 500) + ")")
+assert set(long_and_query) == yoda_set.intersection(darth_set)
+
 """#### With spelling correction"""
 
 mispelled_yNdOg_query = query(ir, "yioda NOT ddarth OR Ganalf", spellingCorrection=True, noprint=False)
@@ -1249,6 +2815,13 @@ We have to use the function `ascii` ([documentation](https://docs.python.org/3/l
 
 assert ascii(ua_posting_list) == ascii(usa_posting_list)
 
+"""The unordered query finds also the documents where the two words are swapped, so its documents are the ones of the ordered queries with the words in both orders."""
+
+au_posting_list, au_phrase_query = phrase_query_ksteps(ir, "America /2 United")
+unordered_ua_posting_list, unordered_ua_phrase_query = phrase_query_ksteps(ir, "United /2 America", ordered=False)
+
+assert set(unordered_ua_posting_list._docIDs) == set(ua_posting_list._docIDs).union(au_posting_list._docIDs)
+
 text = "New /1 city"
 nc_posting_list, nc_phrase_query = phrase_query_ksteps(ir, text, noprint=False)
 
@@ -1262,11 +2835,11 @@ nc_posting_list, nc_phrase_query = phrase_query_ksteps(ir, text, noprint=False)
 def check_trailing_wildcards_queries(wildcard):
     wildcard = normalize(wildcard)
     i = 0
-    while not starts_with(ir._index._dictionary[i].term, wildcard):
+    while not starts_with(ir._index.rotation(i), wildcard):
         i += 1
     plist = []
-    while starts_with(ir._index._dictionary[i].term, wildcard):
-        plist.append(ir._index._dictionary[i].posting_list)
+    while starts_with(ir._index.rotation(i), wildcard):
+        plist.append(ir._index._dictionary[ir._index._permuterm_terms[i]].posting_list)
         i += 1
 
     plist = reduce(lambda x, y: x.union(y), plist)
@@ -1323,4 +2896,702 @@ assert check_general_wildcards_queries("Gan*f") == gan_f_wildcard_query
 
 """#### Multiple wildcards queries"""
 
-pas_s_er_wildcard_query = multiple_wildcards(ir, "pas*s*er", noprint=False)
\ No newline at end of file
+pas_s_er_wildcard_query = multiple_wildcards(ir, "pas*s*er", noprint=False)
+
+"""### Adding and deleting documents
+
+The documents added to the index are found by the queries, and the deleted ones are not returned anymore (also by the NOT queries); a word whose documents have all been deleted is not in the index, so it is corrected. After compacting the index the answers are the same. We update another copy of the index, opened again from its file.
+"""
+
+updated_ir = IRsystem(list(corpus), Index.from_file(filename))
+
+def check_updated_query(text, added=[], deleted=[]):
+    expected = set(ir.answer_boolean_query(text)._docIDs).union(added).difference(deleted)
+    assert set(updated_ir.answer_boolean_query(text)._docIDs) == expected
+
+new_docIDs = updated_ir.add_documents([MovieDescription("The Yoda Chronicles", "Yoda teaches Frodo the art of zorbification")])
+
+check_updated_query("yoda AND frodo", added=new_docIDs)
+assert "zorbification" in updated_ir._index
+assert list(updated_ir.answer_boolean_query("zorbification")._docIDs) == new_docIDs
+
+deleted_docIDs = new_docIDs + [ir.answer_boolean_query("yoda")._docIDs[0]]
+updated_ir.delete_documents(deleted_docIDs)
+
+for text in ["yoda", "yoda AND frodo", "yoda OR darth", "NOT darth", "NOT (yoda OR frodo)"]:
+    check_updated_query(text, deleted=deleted_docIDs)
+assert "zorbification" not in updated_ir._index
+assert updated_ir.correct_words(["zorbification"]) != ["zorbification"]
+
+updated_ir._index.compact()
+
+for text in ["yoda", "yoda AND frodo", "yoda OR darth", "NOT darth", "NOT (yoda OR frodo)"]:
+    check_updated_query(text, deleted=deleted_docIDs)
+assert "zorbification" not in updated_ir._index
+del updated_ir
+
+"""## Benchmarks
+
+The benchmarks compare the implementations used by the system with the ones they replaced. They take a long time (they build the index again several times, also in parallel) and they write some files, so they run only if `run_benchmarks` is `True`.
+"""
+
+run_benchmarks = False
+
+if run_benchmarks:
+    """### Term lookup
+
+    Before adding the hash table `_lookup`, `Index.__getitem__` scanned the whole `_dictionary` (all the rotations of the permuterm index included) for every word of a query. We compare the latency of that linear scan with the one of the hash table lookup.
+    """
+
+    def linear_lookup(index: Index, key: str):
+        """ The old implementation of `Index.__getitem__`, kept to compare it with the hash table lookup.
+        """
+        for term in index._dictionary:
+            if term.term == key:
+                return term.posting_list
+        raise KeyError(f"The term '{key}' is not present in the index.")
+
+    lookup_words = list(map(normalize, ["frodo", "Gandalf", "yoda", "Luke", "darth", "love", "mother", "hello"]))
+
+    tic = time.time()
+    for w in lookup_words:
+        linear_lookup(ir._index, w)
+    toc = time.time()
+    linear_time = (toc-tic) / len(lookup_words)
+    print(f"Linear scan lookup: {round(linear_time*1e3, 3)}ms per term")
+
+    repetitions = 10000
+    tic = time.time()
+    for _ in range(repetitions):
+        for w in lookup_words:
+            ir._index[w]
+    toc = time.time()
+    hash_time = (toc-tic) / (repetitions*len(lookup_words))
+    print(f"Hash table lookup: {round(hash_time*1e6, 3)}µs per term")
+    print(f"Speedup: {round(linear_time/hash_time)}x")
+
+    assert all(linear_lookup(ir._index, w) is ir._index[w] for w in lookup_words)
+
+    """### Memory of the posting lists
+
+    A `PostingList` stores the docIDs and the positions in typed arrays instead of keeping a list of `Posting` objects, each one with its own list of positions. We build the posting lists of a tenth of the terms in the two layouts, and we compare the memory allocated for them (and the peak during their construction) measured with `tracemalloc`.
+    """
+
+    import tracemalloc
+
+    sample = [ir._index._dictionary[i].posting_list for i in range(0, len(ir._index._dictionary), 10)]
+    for plist in sample:
+        plist._docIDs   # the posting lists read from the index file are decoded before the measure
+    for name, build in [("Posting objects", lambda plist: list(plist)),   # the old layout: a list of Postings, each one with a list of positions
+                        ("Arrays", lambda plist: plist._select(range(len(plist))))]:   # a copy of the arrays
+        tracemalloc.start()
+        layout = [build(plist) for plist in sample]
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Posting lists of {len(sample)} terms as {name.lower()}: {round(size/2**20, 1)}MB ({round(peak/2**20, 1)}MB at the peak)")
+    del sample, layout
+
+    """### Intersection and union of frequent terms
+
+    The intersection and the union of two posting lists used to be a loop in Python over the two lists, comparing the postings one by one. Now they use the set operations of Python on the docIDs. We compare the two on the pairs of the most frequent terms of the corpus, for which the posting lists are the longest.
+    """
+
+    def merge_intersection(plist1: PostingList, plist2: PostingList) -> list:
+        """ The two-pointer intersection used before the set operations.
+        """
+        intersection = []
+        i = j = 0
+        while i < len(plist1._docIDs) and j < len(plist2._docIDs):
+            if plist1._docIDs[i] == plist2._docIDs[j]:
+                intersection.append(plist1._docIDs[i])
+                i += 1;  j += 1
+            elif plist1._docIDs[i] < plist2._docIDs[j]:
+                i += 1
+            else:
+                j += 1
+        return intersection
+
+    def merge_union(plist1: PostingList, plist2: PostingList) -> list:
+        """ The two-pointer union used before the set operations.
+        """
+        union = []
+        i = j = 0
+        while i < len(plist1._docIDs) and j < len(plist2._docIDs):
+            if plist1._docIDs[i] == plist2._docIDs[j]:
+                union.append(plist1._docIDs[i])
+                i += 1;  j += 1
+            elif plist1._docIDs[i] < plist2._docIDs[j]:
+                union.append(plist1._docIDs[i])
+                i += 1
+            else:
+                union.append(plist2._docIDs[j])
+                j += 1
+        union.extend(plist1._docIDs[i:])
+        union.extend(plist2._docIDs[j:])
+        return union
+
+    frequent_terms = sorted(ir._index._dictionary, key=lambda t: len(t.posting_list), reverse=True)[:5]
+    frequent_pairs = [(t1, t2) for i, t1 in enumerate(frequent_terms) for t2 in frequent_terms[i+1:]]
+
+    for name, old_op, new_op in [("AND", merge_intersection, lambda x, y: x.intersection(y)), ("OR", merge_union, lambda x, y: x.union(y))]:
+        old_time = new_time = 0
+        for t1, t2 in frequent_pairs:
+            plist1 = t1.posting_list.without_positions()
+            plist2 = t2.posting_list.without_positions()
+            tic = time.time()
+            old_result = old_op(plist1, plist2)
+            toc = time.time()
+            old_time += toc - tic
+            tic = time.time()
+            new_result = new_op(plist1, plist2)
+            toc = time.time()
+            new_time += toc - tic
+            assert old_result == list(new_result._docIDs)
+        print(f"{name} of the pairs of {[t.term for t in frequent_terms]}")
+        print(f"Two-pointer merge: {round(old_time/len(frequent_pairs)*1e3, 3)}ms per pair")
+        print(f"Set operations: {round(new_time/len(frequent_pairs)*1e3, 3)}ms per pair")
+        print(f"Speedup: {round(old_time/new_time, 1)}x")
+
+    """### Intersection of a rare and a frequent term
+
+    When we intersect a rare term with a very frequent one the galloping search jumps ahead in the longest list, instead of walking it element by element.
+    """
+
+    rare_terms = [t for t in ir._index._dictionary if 0 < len(t.posting_list) <= 20][:20]
+    skewed_pairs = [(t1.posting_list.without_positions(), t2.posting_list.without_positions()) for t1 in rare_terms for t2 in frequent_terms]
+
+    tic = time.time()
+    for plist1, plist2 in skewed_pairs:
+        merge_intersection(plist1, plist2)
+    toc = time.time()
+    print(f"Two-pointer merge: {round((toc-tic)/len(skewed_pairs)*1e3, 3)}ms per pair")
+
+    galloping_ratio = PostingList._galloping_ratio
+    PostingList._galloping_ratio = float("inf")   # to always use the set operations
+    tic = time.time()
+    for plist1, plist2 in skewed_pairs:
+        plist1.intersection(plist2)
+    toc = time.time()
+    PostingList._galloping_ratio = galloping_ratio
+    print(f"Set operations: {round((toc-tic)/len(skewed_pairs)*1e3, 3)}ms per pair")
+
+    tic = time.time()
+    for plist1, plist2 in skewed_pairs:
+        plist1.intersection(plist2)
+    toc = time.time()
+    print(f"Galloping search: {round((toc-tic)/len(skewed_pairs)*1e3, 3)}ms per pair")
+
+    """### Order of the intersections in AND queries
+
+    The operands of an AND query are intersected starting from the shortest posting list, and the intersection stops as soon as the result is empty. We compare it with the intersection in the order in which the words are written, on queries where the most frequent words come first.
+    """
+
+    and_queries = [[t.term for t in frequent_terms[:k]] + [rare.term] for rare in rare_terms for k in range(2, len(frequent_terms)+1)]
+    for name, answer in [("Written order", lambda postings: reduce(lambda x, y: x.intersection(y), postings)), ("Shortest first", intersect_all)]:
+        latencies = []
+        for words in and_queries:
+            postings = [ir._index[w].without_positions() for w in words]
+            tic = time.time()
+            answer(postings)
+            toc = time.time()
+            latencies.append(toc-tic)
+        latencies.sort()
+        print(f"{name}: median {round(latencies[len(latencies)//2]*1e3, 3)}ms, max {round(latencies[-1]*1e3, 3)}ms")
+
+    """### NOT queries
+
+    The NOT queries used to copy with `copy.deepcopy` the whole `complete_plist` and to remove from it the excluded postings one by one with `list.remove`. Now they are computed with `PostingList.difference`, which takes linear time and doesn't copy anything. Moreover in `x AND NOT y` the NOT of `y` is never computed, since the query is just the difference between `x` and `y`.
+    """
+
+    def remove_not_query(complete_docIDs: list, docIDs: list) -> list:
+        """ The old NOT query, on lists of docIDs.
+        """
+        result = copy.deepcopy(complete_docIDs)
+        for docID in docIDs:
+            if docID in result:
+                result.remove(docID)
+        return result
+
+    not_term = frequent_terms[-1]
+    not_plist = not_term.posting_list.without_positions()
+    complete_docIDs = list(ir._index.complete_plist._docIDs)
+    tic = time.time()
+    old_result = remove_not_query(complete_docIDs, list(not_plist._docIDs))
+    toc = time.time()
+    print(f"NOT {not_term.term} with deepcopy and list.remove: {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    new_result = ir._index.complete_plist.difference(not_plist)
+    toc = time.time()
+    print(f"NOT {not_term.term} with difference: {round((toc-tic)*1e3, 3)}ms")
+    assert old_result == list(new_result._docIDs)
+
+    rare_plist = rare_terms[0].posting_list.without_positions()
+    tic = time.time()
+    ir._index.complete_plist.difference(not_plist).intersection(rare_plist)
+    toc = time.time()
+    print(f"{rare_terms[0].term} AND NOT {not_term.term} computing the NOT: {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    rare_plist.intersection(NegatedPostingList(not_plist, ir._index.complete_plist))
+    toc = time.time()
+    print(f"{rare_terms[0].term} AND NOT {not_term.term} as a difference: {round((toc-tic)*1e3, 3)}ms")
+
+    """### Boolean query engine
+
+    `query_with_pars` used to look for the innermost parentheses, evaluate them and replace them with their result in the list of the tokens, scanning the whole query again after each step, so its cost was quadratic in the length of the query. Now the query is parsed once in a tree, which is planned and then evaluated. We measure the time of each step on nested queries of increasing depth, built from the example "hello OR ((how AND (are OR you) OR I AND (am AND fine) OR I) AND am AND (sleepy OR hungry) AND cold)".
+    """
+
+    nested_query = "hello OR ((how AND (are OR you) OR I AND (am AND fine) OR I) AND am AND (sleepy OR hungry) AND cold)"
+    for depth in [1, 4, 16, 64]:
+        text = nested_query
+        for _ in range(depth-1):
+            text = f"yoda OR (Gandalf AND NOT ({text}) OR darth)"
+        tic = time.time()
+        tree = parse_query(text)
+        parse_time = time.time() - tic
+        postings = {w: ir._index[w].without_positions() for w in tree.words()}
+        tic = time.time()
+        tree = plan_query(tree, postings, len(ir._index.complete_plist))
+        plan_time = time.time() - tic
+        tic = time.time()
+        ir.evaluate_query(tree, postings)
+        evaluation_time = time.time() - tic
+        print(f"{len(split_query(text))} tokens: parsing {round(parse_time*1e3, 3)}ms, planning {round(plan_time*1e3, 3)}ms, evaluation {round(evaluation_time*1e3, 3)}ms")
+
+    """### Query cache
+
+    The results of the queries are cached, so a repeated query costs only a lookup in the cache, and the sub-expressions shared by different boolean queries are computed only once.
+    """
+
+    repeated_queries = ["yoda OR (Gandalf AND (darth OR love) NOT mother) OR (hello NOT a)", "(darth OR love) AND NOT yoda", "Gandalf AND (darth OR love)", nested_query]
+    ir.invalidate_cache()
+    for text in repeated_queries:
+        tic = time.time()
+        ir.answer_boolean_query(text)
+        toc = time.time()
+        print(f"First time: {round((toc-tic)*1e3, 3)}ms for '{text}'")
+    tic = time.time()
+    for _ in range(100):
+        for text in repeated_queries:
+            ir.answer_boolean_query(text)
+    toc = time.time()
+    print(f"Cached: {round((toc-tic)/(100*len(repeated_queries))*1e3, 3)}ms per query")
+    print(ir.cache_info())
+    ir.invalidate_cache()
+
+    """### Parallel construction of the index
+
+    The index can be built by more processes, each one reading a shard of consecutive documents of the corpus. The index built in parallel is the same of the one built by a single process. The processes are started only with the "fork" start method: with "spawn" (on Windows) they would import this script again, so the index is built by a single process. We report the time of the construction with 1, 2, 4 and 8 processes (the speedup is bounded by the number of cores of the machine, `os.cpu_count()`).
+    """
+
+    print(f"Cores: {os.cpu_count()}")
+    for workers in [1, 2, 4, 8]:
+        tic = time.time()
+        parallel_idx = Index.from_corpus(corpus, workers=workers)
+        toc = time.time()
+        print(f"\n{workers} processes: {round(toc-tic, 3)}s")
+        assert [(t.term, ascii(t.posting_list)) for t in parallel_idx._dictionary] == [(t.term, ascii(t.posting_list)) for t in ir._index._dictionary]
+    del parallel_idx
+
+    """### Loading the index
+
+    We compare the time to load the index with `pickle` (which builds again all the objects) with the time to open the index file with `Index.from_file` and to answer the first query, which reads from the file only the terms and the posting lists it needs. Both indexes answer the same queries.
+    """
+
+    with open("index.pickle", 'wb') as outfile:
+        pickle.dump(Index.from_corpus(corpus), outfile)  # the index in memory (idx could be mapped from the file)
+    tic = time.time()
+    with open("index.pickle", 'rb') as infile:
+        pickled_idx = pickle.load(infile)
+    toc = time.time()
+    print(f"pickle.load: {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    mapped_idx = Index.from_file(filename)
+    toc = time.time()
+    print(f"Index.from_file: {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    mapped_ir = IRsystem(corpus, mapped_idx)
+    mapped_result = mapped_ir.answer_boolean_query("yoda AND NOT darth")
+    toc = time.time()
+    print(f"First query on the mapped index: {round((toc-tic)*1e3, 3)}ms")
+    assert ascii(mapped_result) == ascii(IRsystem(corpus, pickled_idx).answer_boolean_query("yoda AND NOT darth"))
+    assert [(t.term, ascii(t.posting_list)) for t in mapped_idx._dictionary] == [(t.term, ascii(t.posting_list)) for t in pickled_idx._dictionary]
+    assert [t.term for t in mapped_idx._reverse_dictionary] == [t.term for t in pickled_idx._reverse_dictionary]
+    del pickled_idx, mapped_idx, mapped_ir
+
+    """### Compressed posting lists
+
+    We compare the bytes per posting (a docID and its positions) of the posting lists stored as arrays of 4 bytes integers and compressed with gaps and variable byte encoding, and we measure how many numbers (docIDs and positions) per second are decoded.
+    """
+
+    plists = [t.posting_list for t in ir._index._dictionary]
+    encoded = [(plist.encode(), len(plist), len(plist._positions)) for plist in plists]
+    n_postings = sum(n_docs for _, n_docs, _ in encoded)
+    n_numbers = sum(n_docs + n_positions for _, n_docs, n_positions in encoded)
+    raw_bytes = sum(4*(2*n_docs + 1 + n_positions) for _, n_docs, n_positions in encoded)
+    compressed_bytes = sum(len(data) for data, _, _ in encoded)
+    print(f"Arrays: {round(raw_bytes/n_postings, 2)} bytes per posting")
+    print(f"Compressed: {round(compressed_bytes/n_postings, 2)} bytes per posting ({round(raw_bytes/compressed_bytes, 2)}x smaller)")
+    tic = time.time()
+    for data, n_docs, n_positions in encoded:
+        PostingList.from_buffer(data, 0, len(data), n_docs, n_positions)._docIDs  # decoded when the docIDs are used
+    toc = time.time()
+    print(f"Decoding: {round(n_numbers/(toc-tic)/1e6, 2)} millions of numbers per second")
+    assert all(ascii(PostingList.from_buffer(data, 0, len(data), n_docs, n_positions)) == ascii(plist) for plist, (data, n_docs, n_positions) in zip(plists[:1000], encoded[:1000]))
+    del plists, encoded
+
+    """### Incremental updates
+
+    We add documents to an index and we delete some of them, and we compare the results of the queries with the ones of an index built from scratch on the same documents. Adding a document costs much less than building the index again.
+    """
+
+    updated_corpus = list(corpus)
+    updated_ir = IRsystem(updated_corpus, Index.from_file(filename))
+    new_documents = [MovieDescription(f"New movie {i}", corpus[i].description + " yoda") for i in range(100)]
+    tic = time.time()
+    for document in new_documents:
+        updated_ir.add_documents([document])
+    toc = time.time()
+    print(f"Adding a document: {round((toc-tic)/len(new_documents)*1e3, 3)}ms")
+    deleted = [docID for docID in updated_ir.answer_boolean_query("darth")._docIDs[::2]]
+    tic = time.time()
+    updated_ir.delete_documents(deleted)
+    toc = time.time()
+    print(f"Deleting {len(deleted)} documents: {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    rebuilt_idx = Index.from_corpus(updated_corpus)
+    toc = time.time()
+    print(f"\nBuilding the index again: {round((toc-tic)*1e3, 3)}ms")
+    rebuilt_ir = IRsystem(updated_corpus, rebuilt_idx)
+    rebuilt_ir.delete_documents(deleted)
+    for text in ["yoda", "darth", "yoda AND NOT darth", "NOT yoda", "(darth OR love) AND NOT yoda"]:
+        assert ascii(updated_ir.answer_boolean_query(text)) == ascii(rebuilt_ir.answer_boolean_query(text))
+    phrase = tokenize(corpus[0])[:3]
+    assert ascii(updated_ir.answer_phrase_query(phrase)[0]) == ascii(rebuilt_ir.answer_phrase_query(phrase)[0])
+    assert trailing_wildcard(updated_ir, "yod*") == trailing_wildcard(rebuilt_ir, "yod*")
+    assert leading_wildcard(updated_ir, "*oda") == leading_wildcard(rebuilt_ir, "*oda")
+    assert not set(deleted) & set(updated_ir.answer_boolean_query("NOT yoda")._docIDs)
+    rebuilt_idx.compact()
+    updated_ir._index.compact()
+    assert [(t.term, ascii(t.posting_list)) for t in updated_ir._index._dictionary] == [(t.term, ascii(t.posting_list)) for t in rebuilt_idx._dictionary]
+    assert ascii(updated_ir._index.complete_plist) == ascii(rebuilt_idx.complete_plist)
+    assert all(ascii(plist) == ascii(phrase_search([rebuilt_idx[w] for w in pair.split()])) for pair, plist in updated_ir._index._biwords.items())
+    del updated_corpus, updated_ir, rebuilt_ir, rebuilt_idx
+
+    """### Permuterm index
+
+    Before, every rotation of every word was a `Term` in `_dictionary` and in `_reverse_dictionary`, and both lists were sorted. Now the permuterm index is made of two arrays with a termID and a shift for each rotation. We compare the memory and the time to build the two structures (the posting lists, shared by the rotations, are not counted).
+    """
+
+    words = [t.term for t in ir._index._dictionary]
+    tic = time.time()
+    rotation_terms = {w: Term.given_posting_list(w, None) for w in words}
+    for w in words:
+        for r in word_rotations(w + "$"):
+            rotation_terms[r] = Term.given_posting_list(r, None)
+    rotation_dictionary = sorted(rotation_terms.values())
+    rotation_reverse_dictionary = sorted(rotation_terms.values(), key=lambda x: backwards(x.term))
+    toc = time.time()
+    rotations_size = sum(sys.getsizeof(t) + sys.getsizeof(t.__dict__) + sys.getsizeof(t.term) for t in rotation_dictionary) + 2*sys.getsizeof(rotation_dictionary)
+    print(f"Rotations as Terms: {len(rotation_dictionary)} terms, {round(rotations_size/2**20, 1)}MB, built in {round((toc-tic)*1e3, 3)}ms")
+    tic = time.time()
+    permuterm_idx = Index.from_posting_lists([(w, None) for w in words], None)
+    toc = time.time()
+    permuterm_size = sys.getsizeof(permuterm_idx._permuterm_terms) + sys.getsizeof(permuterm_idx._permuterm_shifts)
+    print(f"Permuterm arrays: {len(permuterm_idx._permuterm_terms)} rotations, {round(permuterm_size/2**20, 1)}MB, built in {round((toc-tic)*1e3, 3)}ms (with the dictionaries of the words)")
+    assert [permuterm_idx.rotation(i) for i in range(len(permuterm_idx._permuterm_terms))] == [t.term for t in rotation_dictionary if "$" in t.term]
+    del words, rotation_terms, rotation_dictionary, rotation_reverse_dictionary, permuterm_idx
+
+    """### Trailing wildcards
+
+    The terms matching a trailing wildcard are found with a binary search on the sorted rotations (`Index.prefix_range`) instead of a scan of all the rotations with `starts_with`. We compare the latency of the two lookups for trailing, general and multiple wildcards (the union of the posting lists is not included).
+    """
+
+    def linear_prefix_scan(index: Index, prefix: str) -> List[str]:
+        """ The words of the rotations starting with the prefix, scanning all the rotations.
+        """
+        return [w for r, w in index.rotations() if starts_with(r, prefix)]
+
+    for text in ["abandon*", "pass*er", "a*", "pas*s*er"]:
+        folded = (text + "$")[:text.index("*")] + (text + "$")[text.rindex("*"):]
+        i = folded.index("*")
+        wildcard = normalize(folded[i+1:] + folded[:i])
+        tic = time.time()
+        scanned = linear_prefix_scan(ir._index, wildcard)
+        toc = time.time()
+        scan_time = toc - tic
+        tic = time.time()
+        for _ in range(100):
+            found = [w for _, w in ir._index.rotations(ir._index.prefix_range(wildcard))]
+        toc = time.time()
+        assert found == scanned
+        print(f"{text} ({len(found)} terms): scan {round(scan_time*1e3, 3)}ms, binary search {round((toc-tic)/100*1e3, 3)}ms")
+
+    """### Leading wildcards
+
+    The words matching a leading wildcard are found with a binary search on the reversed words (`Index.suffix_range`) instead of a scan of `_reverse_dictionary` with `ends_with`. Short suffixes like "ing" match many words, but only the matching words are read.
+    """
+
+    for text in ["*ing", "*ed", "*s", "*esk", "*ssenger"]:
+        suffix = normalize(text[1:])
+        tic = time.time()
+        scanned = [t.term for t in ir._index._reverse_dictionary if ends_with(t.term, suffix)]
+        toc = time.time()
+        scan_time = toc - tic
+        tic = time.time()
+        for _ in range(100):
+            found = [ir._index._reverse_dictionary[i].term for i in ir._index.suffix_range(suffix)]
+        toc = time.time()
+        assert found == scanned
+        print(f"{text} ({len(found)} words): scan {round(scan_time*1e3, 3)}ms, binary search {round((toc-tic)/100*1e3, 3)}ms")
+    tic = time.time()
+    leading_wildcard(ir, "*ing")
+    toc = time.time()
+    print(f"*ing query: {round((toc-tic)*1e3, 3)}ms")
+
+    """### Union of many posting lists
+
+    The wildcards matching many words unify many posting lists. We compare the union two by two with `reduce`, which copies the partial result for every list, with the k-way merge of `union_all`.
+    """
+
+    for prefix in ["a", "s", "c"]:
+        postings = [ir._index[w] for _, w in ir._index.rotations(ir._index.prefix_range(prefix))]
+        tic = time.time()
+        reduced = reduce(lambda x, y: x.union(y), postings)
+        toc = time.time()
+        reduce_time = toc - tic
+        tic = time.time()
+        merged = union_all(postings)
+        toc = time.time()
+        assert ascii(merged) == ascii(reduced)
+        print(f"{prefix}* ({len(postings)} posting lists): reduce {round(reduce_time*1e3, 3)}ms, k-way merge {round((toc-tic)*1e3, 3)}ms")
+
+    """### Bitmaps for the dense posting lists
+
+    The dense posting lists are bitmaps in the boolean queries (see `BitmapPostingList`). We compare the size and the time of AND, OR and NOT of the most frequent words as arrays (with the set operations) and as bitmaps.
+    """
+
+    dense_plists = [PostingList.from_arrays(t.posting_list._docIDs) for t in frequent_terms]  # without positions, but as arrays
+    bitmaps = [t.posting_list.without_positions() for t in frequent_terms]
+    assert all(isinstance(bitmap, BitmapPostingList) for bitmap in bitmaps)
+    array_size = sum(sys.getsizeof(plist._docIDs) for plist in dense_plists)
+    bitmap_size = sum(sys.getsizeof(bitmap._bitmap) for bitmap in bitmaps)
+    print(f"{len(bitmaps)} most frequent words: arrays {round(array_size/1024, 1)}KB, bitmaps {round(bitmap_size/1024, 1)}KB")
+    complete_array = PostingList.from_arrays(ir._index.complete_plist._docIDs)
+    complete_bitmap = ir._index.complete_plist.without_positions()
+    for name, op in [("AND", lambda x, y, complete: x.intersection(y)), ("OR", lambda x, y, complete: x.union(y)),
+                     ("NOT", lambda x, y, complete: complete.difference(x))]:
+        times = []
+        for plists, complete in [(dense_plists, complete_array), (bitmaps, complete_bitmap)]:
+            tic = time.time()
+            results = [op(plists[i], plists[j], complete) for i in range(len(plists)) for j in range(i+1, len(plists))]
+            toc = time.time()
+            times.append((toc - tic) / len(results))
+        print(f"{name}: arrays {round(times[0]*1e3, 3)}ms, bitmaps {round(times[1]*1e3, 3)}ms per operation")
+        assert [list(r._docIDs) for r in results] == [list(op(dense_plists[i], dense_plists[j], complete_array)._docIDs) for i in range(len(bitmaps)) for j in range(i+1, len(bitmaps))]
+    del dense_plists, bitmaps, complete_array, complete_bitmap
+
+    """### Spelling correction
+
+    We compare the latency of the correction of a misspelled word by scanning the words with the same initial letter (`find_nearest` with `keep_first`) and by scanning all the words.
+    """
+
+    misspelled_words = ["yioda", "lukke", "darhth", "frodoo", "ganalf", "ddarth", "lovve", "motther", "helloo", "greatt", "britin"]
+    dictionary = [t.term for t in ir._index._dictionary]
+    for name, correct in [("Same initial letter", lambda w: find_nearest(w, dictionary, keep_first=True)),
+                          ("All the words", lambda w: find_nearest(w, dictionary))]:
+        tic = time.time()
+        corrections = [correct(w) for w in misspelled_words]
+        toc = time.time()
+        print(f"{name}: {round((toc-tic)/len(misspelled_words)*1e3, 3)}ms per word")
+    nearest_words = corrections
+
+    """### Edit distance
+
+    The edit distance used to fill the whole dynamic programming matrix, as a list of lists, for every pair of words. We compare it with the bit-parallel algorithm (with and without the cutoff at the distance of the nearest word found until then) on the correction of the misspelled words by scanning all the words.
+    """
+
+    def legacy_edit_distance(u, v):
+        nrows = len(u) + 1
+        ncols = len(v) + 1
+        M = [[0] * ncols for i in range(0, nrows)]
+        for i in range(0, nrows):
+            M[i][0] = i
+        for j in range(0, ncols):
+            M[0][j] = j
+        for i in range(1, nrows):
+            for j in range(1, ncols):
+                candidates = [M[i-1][j] + 1, M[i][j-1] + 1]
+                if (u[i-1] == v[j-1]):
+                    candidates.append(M[i-1][j-1])
+                else:
+                    candidates.append(M[i-1][j-1] + 1)
+                M[i][j] = min(candidates)
+        return M[-1][-1]
+
+    for name, correct in [("Matrix", lambda w: min(zip(map(lambda x: legacy_edit_distance(w, x), dictionary), dictionary))[1]),
+                          ("Bit-parallel", lambda w: min(zip(edit_distances(w, dictionary), dictionary))[1]),
+                          ("Bit-parallel with cutoff", lambda w: find_nearest(w, dictionary))]:
+        tic = time.time()
+        corrections = [correct(w) for w in misspelled_words]
+        toc = time.time()
+        print(f"{name}: {round((toc-tic)/len(misspelled_words)*1e3, 3)}ms per word")
+        assert corrections == nearest_words
+
+    """### Vocabulary
+
+    Before the `Vocabulary`, the list of the words was rebuilt from the dictionary at every correction. We compare it with the length groups of the `Vocabulary` of the index (`scan_nearest`, correcting all the words together like the words of a query) and with its deletion index (`Index.nearest_words`).
+    """
+
+    for name, correct in [("Rebuilt list of words", lambda words: [find_nearest(w, [t.term for t in ir._index._dictionary]) for w in words]),
+                          ("Length groups", lambda words: [w for _, w in ir._index._vocabulary.scan_nearest(words)]),
+                          ("Deletion index", ir._index.nearest_words)]:
+        tic = time.time()
+        corrections = correct(misspelled_words)
+        toc = time.time()
+        print(f"{name}: {round((toc-tic)/len(misspelled_words)*1e3, 3)}ms per word")
+        assert corrections == nearest_words
+
+    """### Deletion index
+
+    The time to correct a word with the length groups grows linearly with the number of words, while the deletion index makes a few binary searches. We build vocabularies with 1/8, 1/4, 1/2 and all the words of the index, and we correct 200 of their words with a character replaced, reporting also the time to build the deletion index and its size.
+    """
+
+    all_words = list(ir._index._vocabulary.words)
+    for fraction in [8, 4, 2, 1]:
+        words = all_words[::fraction]
+        tic = time.time()
+        vocabulary = Vocabulary.from_words(words)
+        toc = time.time()
+        build_time = toc - tic
+        typos = [w[:len(w)//2] + ("q" if w[len(w)//2] != "q" else "z") + w[len(w)//2+1:] for w in words[::max(len(words) // 200, 1)]]
+        times = []
+        for correct in [vocabulary.scan_nearest, vocabulary.nearest_words]:
+            tic = time.time()
+            corrections = correct(typos)
+            toc = time.time()
+            times.append((toc - tic) / len(typos))
+        assert corrections == vocabulary.scan_nearest(typos)
+        print(f"{len(words)} words: length groups {round(times[0]*1e3, 3)}ms, deletion index {round(times[1]*1e3, 3)}ms per word "
+              f"(built in {round(build_time, 3)}s, {round(len(vocabulary._deletes)*8/2**20, 1)}MB)")
+    del all_words, vocabulary
+
+    """### Phrase queries
+
+    The phrase queries used to chain `positional_search` from the first word to the last one, merging the positions of every document shared by the first words. `phrase_search` starts from the rarest word and checks the positions only in the documents containing all the words. We compare them on long phrases taken from the corpus, choosing the ones whose rarest word is the most frequent (i.e. phrases made of common words).
+    """
+
+    def chained_phrase_search(postings: List[PostingList]) -> PostingList:
+        plist = postings[0]
+        for i, other in enumerate(postings[1:], 1):
+            plist = plist.positional_search(other, i)
+        return plist
+
+    for length in [2, 4, 6, 8]:
+        windows = {tuple(words[i:i+length]) for words in map(tokenize, corpus[:2000]) for i in range(len(words) - length + 1)}
+        phrases = sorted(windows, key=lambda phrase: min(len(ir._index[w]) for w in phrase), reverse=True)[:20]
+        times = []
+        results = []
+        for search in [chained_phrase_search, phrase_search]:
+            tic = time.time()
+            results.append([search([ir._index[w] for w in phrase]) for phrase in phrases])
+            toc = time.time()
+            times.append((toc - tic) / len(phrases))
+        print(f"Phrases of {length} words: chained {round(times[0]*1e3, 3)}ms, rarest first {round(times[1]*1e3, 3)}ms per phrase")
+        assert [(list(r._docIDs), list(r._positions)) for r in results[0]] == [(list(r._docIDs), list(r._positions)) for r in results[1]]
+
+    """### Proximity queries
+
+    The query 'term1 /k term2' used to call `positional_search` once for each step from 1 to k+1 and to unify the results, so its cost grew with k. `proximity_search` scans the positions of each document once. We compare them on the pairs of the most frequent terms, and we check that they find the same documents and that the unordered search finds also the ones with the two words swapped.
+    """
+
+    def stepwise_proximity_search(plist1: PostingList, plist2: PostingList, k: int) -> PostingList:
+        return union_all([plist1.positional_search(plist2, i) for i in range(1, k+2)])
+
+    frequent_pairs = [(t1.posting_list, t2.posting_list) for t1 in frequent_terms[:3] for t2 in frequent_terms[:3] if t1 is not t2]
+    for k in [1, 5, 20, 50]:
+        times = []
+        results = []
+        for search in [stepwise_proximity_search, PostingList.proximity_search, lambda plist1, plist2, k: plist1.proximity_search(plist2, k, ordered=False)]:
+            tic = time.time()
+            results.append([search(plist1, plist2, k) for plist1, plist2 in frequent_pairs])
+            toc = time.time()
+            times.append((toc - tic) / len(frequent_pairs))
+        print(f"/{k}: one search per step {round(times[0]*1e3, 3)}ms, single pass {round(times[1]*1e3, 3)}ms, unordered {round(times[2]*1e3, 3)}ms per query")
+        assert [list(r._docIDs) for r in results[0]] == [list(r._docIDs) for r in results[1]]
+        swapped = {(id(plist1), id(plist2)): r for (plist1, plist2), r in zip(frequent_pairs, results[1])}
+        for (plist1, plist2), r in zip(frequent_pairs, results[2]):
+            assert set(r._docIDs) == set(swapped[id(plist1), id(plist2)]._docIDs).union(swapped[id(plist2), id(plist1)]._docIDs)
+
+    """### Biword index
+
+    The index of the script has a biword index with the pairs of words found in at least 100 documents. We compare the phrase queries made of these pairs, and the longer phrases of the corpus containing them, answered with the posting lists of the words only and with the biword index.
+    """
+
+    biword_phrases = [tuple(pair.split()) for pair in ir._index._biwords]
+    biword_phrases += sorted({tuple(words[i:i+4]) for words in map(tokenize, corpus[:2000]) for i in range(len(words) - 3)
+                              if " ".join(words[i+1:i+3]) in ir._index._biwords})[:100]
+    for length in [2, 4]:
+        phrases = [phrase for phrase in biword_phrases if len(phrase) == length]
+        times = []
+        results = []
+        for search in [lambda phrase: phrase_search([ir._index[w] for w in phrase]), ir._index.phrase]:
+            tic = time.time()
+            results.append([search(phrase) for phrase in phrases])
+            toc = time.time()
+            times.append((toc - tic) / max(len(phrases), 1))
+        print(f"{len(phrases)} phrases of {length} words: words only {round(times[0]*1e3, 3)}ms, biword index {round(times[1]*1e3, 3)}ms per phrase")
+        assert [ascii(r) for r in results[0]] == [ascii(r) for r in results[1]]
+
+    """### Reading the corpus
+
+    The corpus used to be read in a list of `MovieDescription`s, with all the descriptions in memory. We compare the memory allocated to read it (measured with `tracemalloc`) and the time to read it with the one of a `Corpus`, which keeps only the titles and the positions of the descriptions, and the time to fetch the documents of a query. We check that the documents are the same, also when the file of the descriptions is compressed with gzip (and it is decompressed in a temporary file).
+    """
+
+    def legacy_read_movie_descriptions():
+        names_table = {}
+        with open('data/movie.metadata.tsv', 'r') as csv_file:
+            for name in csv.reader(csv_file, delimiter = '\t'):
+                names_table[name[0]] = name[2]
+        corpus = []
+        with open('data/plot_summaries.txt', 'r') as csv_file:
+            for desc in csv.reader(csv_file, delimiter = '\t'):
+                if desc[0] in names_table:
+                    corpus.append(MovieDescription(names_table[desc[0]], desc[1]))
+        return corpus
+
+    readers = [("List of documents", legacy_read_movie_descriptions), ("Corpus", read_movie_descriptions)]
+    read_corpora = []
+    for name, read in readers:
+        tracemalloc.start()
+        tic = time.time()
+        read_corpora.append(read())
+        toc = time.time()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name}: read in {round(toc-tic, 3)}s, {round(size/2**20, 1)}MB ({round(peak/2**20, 1)}MB at the peak)")
+    result = ir.answer_boolean_query("love")
+    for (name, _), read_corpus in zip(readers, read_corpora):
+        tic = time.time()
+        documents = result.get_from_corpus(read_corpus)
+        toc = time.time()
+        print(f"{name}: {len(documents)} documents of a query in {round((toc-tic)*1e3, 3)}ms")
+    assert [(d.title, d.description) for d in read_corpora[0]] == [(d.title, d.description) for d in read_corpora[1]]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        compressed = os.path.join(tmpdir, "plot_summaries.txt.gz")
+        with open('data/plot_summaries.txt', 'rb') as f_in, gzip.open(compressed, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        tic = time.time()
+        with read_movie_descriptions(compressed) as compressed_corpus:
+            toc = time.time()
+            print(f"Compressed corpus: read in {round(toc-tic, 3)}s")
+            tic = time.time()
+            documents = result.get_from_corpus(compressed_corpus)
+            toc = time.time()
+            print(f"Compressed corpus: {len(documents)} documents of a query in {round((toc-tic)*1e3, 3)}ms")
+            assert [(d.title, d.description) for d in compressed_corpus] == [(d.title, d.description) for d in read_corpora[0]]
+            assert [(d.title, d.description) for d in documents] == [(d.title, d.description) for d in result.get_from_corpus(read_corpora[0])]
+        assert not os.path.exists(compressed_corpus._filename)
+    read_corpora[1].close()
+    del read_corpora, compressed_corpus
+
+corpus.close()  # the descriptions of the results are read from the file of the corpus until the end